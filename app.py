@@ -13,11 +13,33 @@ import numpy as np
 import plotly.express as px
 from datetime import datetime, timedelta
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import plotly.graph_objects as go
-import random
-from time import time
 import threading
 from time import time, sleep
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from collections import OrderedDict
+from contextlib import contextmanager
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import uuid
+import xlsxwriter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Sans pyarrow, pas de snapshot disque : rechargement complet au démarrage
+    pa = pq = None
+
+try:
+    import websocket
+except ImportError:  # Sans websocket-client, pas de flux direct : synchronisation périodique seule
+    websocket = None
 
 # Définir COLORS avant toute utilisation
 COLORS = {
@@ -44,29 +66,38 @@ BACKGROUND_IMAGES = [
     "https://res.cloudinary.com/one-degree-organic-foods/image/fetch/c_fit,h_720,w_1280,d_farmer_default.png/https://onedegreeorganics.com/wp-content/uploads/2023/01/DSC00973-scaled.jpg"
 ]
 
-def get_randomized_url(url):
-    """Ajoute un timestamp pour éviter le cache du navigateur"""
-    return f"{url}?random={int(time())}"
+ROTATION_FOND_SECONDES = 60  # Durée d'affichage de chaque image
 
-# Thread pour rotation automatique
-def rotate_background():
-    while True:
-        sleep(0.05)  # Change toutes les 60 secondes
-        st.experimental_rerun()
+def keyframes_fond(images):
+    """Animation CSS faisant défiler les images dans le navigateur, sans rerun serveur.
+    
+    Les URLs sont fixes (pas de paramètre anti-cache) : chaque image n'est téléchargée qu'une fois.
+    """
+    voile = "linear-gradient(rgba(255,255,255,0.88), rgba(255,255,255,0.88))"
+    tranche = 100 / len(images)
+    etapes = []
+    for i, url in enumerate(images):
+        # Image affichée pendant 95% de sa tranche, puis fondu vers la suivante
+        debut, fin = i * tranche, i * tranche + tranche * 0.95
+        etapes.append(f'{debut:.2f}%, {fin:.2f}% {{ background-image: {voile}, url("{url}"); }}')
+    etapes.append(f'100% {{ background-image: {voile}, url("{images[0]}"); }}')
+    return "@keyframes rotation-fond { " + " ".join(etapes) + " }"
 
-# CSS avec arrière-plan dynamique
+# CSS avec arrière-plan tournant côté navigateur
 st.markdown(f"""
 <style>
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;600&display=swap');
     
+    {keyframes_fond(BACKGROUND_IMAGES)}
+    
     .stApp {{
         background: linear-gradient(rgba(255,255,255,0.88), rgba(255,255,255,0.88)), 
-                    url("{get_randomized_url(random.choice(BACKGROUND_IMAGES))}");
+                    url("{BACKGROUND_IMAGES[0]}");
         background-size: cover;
         background-position: center;
         background-attachment: fixed;
         background-repeat: no-repeat;
-        transition: background-image 1.2s ease-in-out;
+        animation: rotation-fond {ROTATION_FOND_SECONDES * len(BACKGROUND_IMAGES)}s ease-in-out infinite;
     }}
     
     /* Votre CSS existant */
@@ -94,11 +125,6 @@ st.markdown(f"""
 </style>
 """, unsafe_allow_html=True)
 
-# Démarrer le thread (une seule fois)
-if not hasattr(st.session_state, 'bg_thread'):
-    st.session_state.bg_thread = threading.Thread(target=rotate_background, daemon=True)
-    st.session_state.bg_thread.start()
-
 # --------------------------
 # 🔐 AUTHENTIFICATION & CONFIG
 # --------------------------
@@ -109,16 +135,16 @@ CREDENTIALS = {
     "marwa": {"password": "vacpa2025", "role": "operateur"}
 }
 
-# Initialiser les seuils dans session_state
-if 'seuils' not in st.session_state:
-    st.session_state.seuils = {
-        "rendement": {"haut": 4.5, "moyen": 4.0},
-        "non_productivite": 20,
-        "sous_performance": 25,
-        "variabilite": 5,
-        "pannes": 3,
-        "erreurs": 10
-    }
+# Seuils par défaut ; les seuils en vigueur sont enregistrés dans SEUILS_FICHIER (section 🎚️ SEUILS)
+# Rendement : critique / moyen / haut bornent aussi les niveaux Critique, Faible, Acceptable, Excellent
+SEUILS_DEFAUT = {
+    "rendement": {"haut": 4.5, "moyen": 4.0, "critique": 3.5},
+    "non_productivite": 20,
+    "sous_performance": 25,
+    "variabilite": 5,
+    "pannes": 3,
+    "erreurs": 10
+}
 
 if "authenticated" not in st.session_state:
     st.session_state.authenticated = False
@@ -134,6 +160,7 @@ SUPABASE_KEY = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJpc3MiOiJzdXBhYmFzZSIsInJ
 TABLE_RENDEMENT = "rendements"
 TABLE_PANNES = "pannes"
 TABLE_ERREURS = "erreurs"
+TABLES = [TABLE_RENDEMENT, TABLE_PANNES, TABLE_ERREURS]
 
 headers = {
     "apikey": SUPABASE_KEY,
@@ -142,80 +169,1627 @@ headers = {
     "Prefer": "return=representation"
 }
 
+# Synchronisation incrémentale : seules les lignes au-delà du dernier id /
+# created_at connu sont téléchargées à chaque expiration du cache
+SYNC_INCREMENTALE = True
+SYNC_SONDES = True  # Sonde (nombre de lignes, id max) avant chaque delta : tables inchangées ignorées
+SYNC_TTL = 60  # Secondes entre deux synchronisations en arrière-plan de la copie locale
+SYNC_TTL_DIRECT = 300  # Synchronisation de rattrapage quand le flux direct est connecté
+PREMIER_CHARGEMENT_DELAI = 60  # Attente max. de la première synchro quand aucun snapshot n'existe
+
+# Pagination : PostgREST tronque silencieusement les réponses à max-rows
+# (1000 par défaut sur Supabase), PAGE_SIZE ne doit pas dépasser cette valeur
+PAGE_SIZE = 1000
+MAX_CONCURRENCE = 3  # Nombre de tables téléchargées en parallèle
+
+# Classification du rendement (kg/h), bornée par les seuils : Faible et Critique comptent comme non productifs
+LABELS_NIVEAU = ["Critique", "Faible", "Acceptable", "Excellent"]
+DTYPE_NIVEAU = pd.CategoricalDtype(LABELS_NIVEAU, ordered=True)
+LIGNES = [1, 2]  # Lignes toujours affichées, même sans pesée
+
+# Colonnes réellement utilisées par le tableau de bord (select= PostgREST).
+# rendement est calculé localement, niveau_rendement à l'affichage depuis les seuils.
+COLONNES = {
+    TABLE_RENDEMENT: ["id", "operatrice_id", "ligne", "poids_kg", "heure_travail",
+                      "date", "created_at", "numero_pesee"],
+    TABLE_PANNES: ["id", "ligne", "date_heure", "type_erreur", "gravite",
+                   "operatrice_id", "created_at"],
+    TABLE_ERREURS: ["id", "ligne", "date_heure", "type_erreur", "gravite",
+                    "operatrice_id", "created_at"]
+}
+
+# Colonnes texte volumineuses, chargées à la demande pour les lignes affichées
+COLONNES_TEXTE = {
+    TABLE_RENDEMENT: ["commentaire_pesee"],
+    TABLE_PANNES: ["description"],
+    TABLE_ERREURS: ["description"]
+}
+
+# Colonnes horodatées, converties une seule fois au décodage
+COLONNES_DATES = {
+    TABLE_RENDEMENT: ["date", "created_at"],
+    TABLE_PANNES: ["date_heure", "created_at"],
+    TABLE_ERREURS: ["date_heure", "created_at"]
+}
+
+# Types compacts des tables chargées : les DataFrames sont gardés par processus
+# et recopiés dans les vues filtrées de chaque session.
+# "int8" / "int32" retombent en float32 si la colonne contient des valeurs manquantes.
+# Catégories ordonnées : les valeurs hors référentiel sont conservées, rangées après celles-ci.
+GRAVITES = ["Léger", "Modéré", "Grave", "Critique"]
+SCHEMA = {
+    TABLE_RENDEMENT: {
+        "operatrice_id": "category", "ligne": "int8", "numero_pesee": "int32",
+        "poids_kg": "float32", "heure_travail": "float32", "rendement": "float32"
+    },
+    TABLE_PANNES: {
+        "operatrice_id": "category", "type_erreur": "category", "ligne": "int8",
+        "gravite": pd.CategoricalDtype(GRAVITES, ordered=True)
+    },
+    TABLE_ERREURS: {
+        "operatrice_id": "category", "type_erreur": "category", "ligne": "int8",
+        "gravite": pd.CategoricalDtype(GRAVITES, ordered=True)
+    }
+}
+
+# --------------------------
+# 🌐 CLIENT SUPABASE
+# --------------------------
+SUPABASE_TIMEOUT = (3.05, 20)  # Délais (connexion, lecture) en secondes
+SUPABASE_RETRIES = 3
+
+@st.cache_resource
+def get_supabase_session():
+    """Session HTTP partagée par le processus : keep-alive, pool de connexions et retries"""
+    session = requests.Session()
+    session.headers.update(headers)
+    session.headers["Accept-Encoding"] = "gzip"
+    
+    # Retries avec backoff uniquement sur les lectures : un POST rejoué pourrait dupliquer une ligne
+    retry = Retry(
+        total=SUPABASE_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def supabase_get(table, params=None, session=None, **kwargs):
+    """GET PostgREST via la session partagée (passer `session` depuis un thread)"""
+    session = session or get_supabase_session()
+    return session.get(f"{SUPABASE_URL}/rest/v1/{table}", params=params, timeout=SUPABASE_TIMEOUT, **kwargs)
+
+def supabase_post(table, data, session=None, **kwargs):
+    """POST PostgREST via la session partagée"""
+    session = session or get_supabase_session()
+    return session.post(f"{SUPABASE_URL}/rest/v1/{table}", json=data, timeout=SUPABASE_TIMEOUT, **kwargs)
+
 # --------------------------
 # 🧩 FONCTIONS UTILITAIRES
 # --------------------------
-@st.cache_data(ttl=60)
+def etat_vide():
+    """État d'une table jamais synchronisée"""
+    return {"df": None, "rollup": None, "version": 0, "version_snapshot": 0,
+            "dernier_id": None, "dernier_created_at": None, "ids_ecrits": set()}
+
+@st.cache_resource
+def get_table_store():
+    """Copie locale des tables, partagée par toutes les sessions du processus.
+    
+    Amorcée depuis le dernier snapshot disque : seul le delta est ensuite téléchargé.
+    """
+    store = {
+        "lock": threading.Lock(),  # Protège les états des tables (lecture et échange)
+        "synchro_lock": threading.Lock(),  # Une seule synchronisation à la fois
+        "pret": threading.Event(),  # Levé dès qu'une copie complète est disponible
+        "derniere_synchro": 0.0,
+        "dernier_snapshot": 0.0,
+        "direct": False,  # Flux Realtime connecté : les insertions arrivent sans attendre la synchro
+        "erreurs": {},
+        "colonnes": {},
+        "sondes": {table: {"inchangee": 0, "modifiee": 0} for table in TABLES},
+        "tables": {table: etat_vide() for table in TABLES}
+    }
+    charger_snapshots(store)
+    return store
+
+def preparer_table(table, df):
+    """Conversions de type et colonnes dérivées, appliquées uniquement aux lignes reçues.
+    
+    Les colonnes déjà typées (décodage CSV) ne sont pas reconverties.
+    """
+    # Conversions de type
+    for col in COLONNES_DATES[table]:
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    
+    # Calculs spécifiques pour la table rendement
+    if table == TABLE_RENDEMENT:
+        # Gestion des colonnes manquantes avec valeurs par défaut
+        if 'poids_kg' not in df.columns:
+            df['poids_kg'] = 0
+        if 'heure_travail' not in df.columns:
+            df['heure_travail'] = 5.0
+        
+        # Conversion numérique
+        for col, defaut in (("poids_kg", 0), ("heure_travail", 5.0)):
+            if not pd.api.types.is_float_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], errors="coerce")
+            df[col] = df[col].fillna(defaut)
+        
+        # Calcul du rendement (la classification dépend des seuils : voir avec_niveau)
+        df["rendement"] = df["poids_kg"] / df["heure_travail"]
+    
+    return appliquer_schema(table, df)
+
+def types_csv(table):
+    """dtype de pd.read_csv pour les colonnes sélectionnées : entiers nullables, catégories, float32"""
+    types = {"id": "int64"}
+    for col, dtype in SCHEMA[table].items():
+        if col in COLONNES[table]:
+            if isinstance(dtype, pd.CategoricalDtype):
+                types[col] = "category"  # Ordre et valeurs inconnues : voir appliquer_schema
+            else:
+                types[col] = {"int8": "Int8", "int32": "Int32"}.get(dtype, dtype)
+    return types
+
+def decoder_csv(table, contenu):
+    """Décode une page CSV PostgREST directement en colonnes typées.
+    
+    Évite la liste de dicts de response.json() et les conversions colonne par colonne.
+    PostgREST écrit NULL comme un champ vide : seul "" est lu comme manquant.
+    """
+    if not contenu.strip():
+        return pd.DataFrame(columns=COLONNES[table])
+    df = pd.read_csv(io.BytesIO(contenu), dtype=types_csv(table),
+                     keep_default_na=False, na_values=[""])
+    for col in COLONNES_DATES[table]:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], format="ISO8601", errors="coerce")
+    return df
+
+def categories_etendues(dtype, *series):
+    """Catégories ordonnées du schéma suivies des valeurs inconnues rencontrées.
+    
+    Une valeur hors référentiel devient une catégorie de plus au lieu de NaN :
+    la ligne reste comptée (voir valeurs_hors_referentiel).
+    """
+    trouvees = set()
+    for serie in series:
+        valeurs = serie.cat.categories if isinstance(serie.dtype, pd.CategoricalDtype) else serie.dropna().unique()
+        trouvees.update(valeurs)
+    inconnues = sorted(str(v) for v in trouvees if v not in dtype.categories)
+    return pd.CategoricalDtype(list(dtype.categories) + inconnues, ordered=True)
+
+def appliquer_schema(table, df):
+    """Convertit les colonnes présentes vers leur type compact (SCHEMA)"""
+    for col, dtype in SCHEMA[table].items():
+        if col not in df.columns:
+            continue
+        if isinstance(dtype, pd.CategoricalDtype):
+            dtype = categories_etendues(dtype, df[col])
+        if df[col].dtype == dtype:
+            continue
+        if dtype in ("int8", "int32"):
+            valeurs = pd.to_numeric(df[col], errors="coerce")
+            df[col] = valeurs.astype(dtype) if valeurs.notna().all() else valeurs.astype("float32")
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+def concatener(table, frames):
+    """pd.concat conservant les catégories du schéma.
+    
+    Des catégories différentes d'un morceau à l'autre feraient retomber la colonne en object :
+    on aligne d'abord les catégories (union), ce qui ne touche que les codes.
+    """
+    frames = [f.copy(deep=False) for f in frames]
+    for col, dtype in SCHEMA[table].items():
+        if not isinstance(dtype, pd.CategoricalDtype) and dtype != "category":
+            continue
+        if not all(col in f.columns and isinstance(f[col].dtype, pd.CategoricalDtype) for f in frames):
+            continue
+        if isinstance(dtype, pd.CategoricalDtype):
+            # Ordonnées : référentiel d'abord, valeurs inconnues de tous les morceaux ensuite
+            cible = categories_etendues(dtype, *(f[col] for f in frames))
+        else:
+            categories = frames[0][col].cat.categories
+            for f in frames[1:]:
+                categories = categories.union(f[col].cat.categories)
+            cible = pd.CategoricalDtype(categories)
+        for f in frames:
+            f[col] = f[col].astype(cible)
+    return pd.concat(frames, ignore_index=True)
+
+def valeurs_hors_referentiel():
+    """Valeurs des colonnes à référentiel (gravité) absentes de celui-ci, avec leur nombre de lignes"""
+    store = get_table_store()
+    lignes = []
+    for table in TABLES:
+        df = store["tables"][table]["df"]
+        if df is None or df.empty:
+            continue
+        for col, dtype in SCHEMA[table].items():
+            if isinstance(dtype, pd.CategoricalDtype) and col in df.columns:
+                inconnues = df.loc[~df[col].isin(dtype.categories) & df[col].notna(), col]
+                for valeur, nombre in inconnues.value_counts().items():
+                    if nombre:
+                        lignes.append({"Table": table, "Colonne": col, "Valeur": valeur, "Lignes": int(nombre)})
+    return pd.DataFrame(lignes)
+
+def types_larges(table, df):
+    """Types qu'auraient les colonnes du schéma sans compaction (object / int64 / float64)"""
+    types = {}
+    for col, dtype in SCHEMA[table].items():
+        if col not in df.columns:
+            continue
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            types[col] = object
+        elif dtype in ("int8", "int32") and df[col].notna().all():
+            types[col] = "int64"
+        else:
+            types[col] = "float64"
+    return types
+
+def rapport_memoire():
+    """Mémoire de chaque table partagée, avant / après compaction des types"""
+    store = get_table_store()
+    lignes = []
+    for table in TABLES:
+        df = store["tables"][table]["df"]
+        if df is None:
+            continue
+        avant = df.astype(types_larges(table, df)).memory_usage(deep=True).sum()
+        apres = df.memory_usage(deep=True).sum()
+        lignes.append({
+            "Table": table,
+            "Lignes": len(df),
+            "Avant (Mo)": round(avant / 1e6, 2),
+            "Après (Mo)": round(apres / 1e6, 2),
+            "Gain (%)": round(100 * (1 - apres / avant), 1) if avant else 0.0
+        })
+    return pd.DataFrame(lignes)
+
+# Clés des agrégats maintenus pour les graphiques et classements
+CLES_ROLLUP = {
+    TABLE_RENDEMENT: ["jour", "ligne", "operatrice_id"],
+    TABLE_PANNES: ["jour", "heure", "ligne", "type_erreur", "gravite"],
+    TABLE_ERREURS: ["jour", "heure", "ligne", "type_erreur", "gravite"]
+}
+
+def construire_rollup(table, df):
+    """Agrégats compacts d'une table (taille ~ jours × lignes × opératrices, pas nombre de pesées).
+    
+    Rendements : kg, heures, nb, nb_pesees, somme et somme des carrés du rendement.
+    Pannes / erreurs : nombre de signalements par jour, heure, ligne, type et gravité.
+    """
+    cles = CLES_ROLLUP[table]
+    if table == TABLE_RENDEMENT:
+        colonnes = cles + ["kg", "heures", "nb", "nb_pesees", "somme_rendement", "somme_carres"]
+        if df.empty or 'date' not in df.columns:
+            return pd.DataFrame(columns=colonnes)
+        rendement = df["rendement"].astype(float).fillna(0)
+        base = pd.DataFrame({
+            "jour": df["date"].dt.normalize(),
+            "ligne": df["ligne"],
+            "operatrice_id": df["operatrice_id"],
+            # Sommes en float64 : l'accumulation en float32 perdrait en précision
+            "kg": df["poids_kg"].astype(float),
+            "heures": df["heure_travail"].astype(float),
+            "nb": df["rendement"].notna().astype(int),
+            "nb_pesees": df["numero_pesee"].notna().astype(int),
+            "somme_rendement": rendement,
+            "somme_carres": rendement * rendement
+        })
+    else:
+        colonnes = cles + ["nb"]
+        if df.empty or 'date_heure' not in df.columns:
+            return pd.DataFrame(columns=colonnes)
+        base = pd.DataFrame({
+            "jour": df["date_heure"].dt.normalize(),
+            "heure": df["date_heure"].dt.hour,
+            "ligne": df["ligne"],
+            "type_erreur": df["type_erreur"],
+            "gravite": df["gravite"],
+            "nb": 1
+        })
+    return base.groupby(cles, dropna=False, observed=True, sort=False).sum().reset_index()
+
+def fusionner_rollups(table, rollup, increment):
+    """Ajoute l'agrégat de nouvelles lignes à un agrégat existant"""
+    if rollup is None or rollup.empty:
+        return increment
+    if increment.empty:
+        return rollup
+    cles = CLES_ROLLUP[table]
+    return pd.concat([rollup, increment], ignore_index=True).groupby(
+        cles, dropna=False, observed=True, sort=False
+    ).sum().reset_index()
+
+def perf_par_groupe(rollup, cles):
+    """Rendement moyen, total kg et nombre de pesées par groupe, depuis l'agrégat des rendements"""
+    perf = rollup.groupby(cles, observed=True)[["somme_rendement", "nb", "kg", "nb_pesees"]].sum()
+    perf["rendement"] = perf["somme_rendement"] / perf["nb"].where(perf["nb"] > 0)
+    return perf.reset_index()
+
+def compter_signalements(rollup, cle):
+    """Nombre de pannes / erreurs par valeur de `cle`, depuis l'agrégat"""
+    return rollup.groupby(cle, observed=True)["nb"].sum().reset_index(name='count')
+
+def ajouter_lignes(etat, table, nouvelles):
+    """Ajoute des lignes typées à la copie locale et met à jour ses agrégats"""
+    if etat["df"] is None:
+        etat["df"] = nouvelles
+        etat["rollup"] = construire_rollup(table, nouvelles)
+        etat["version"] += 1
+    elif not nouvelles.empty:
+        etat["df"] = concatener(table, [etat["df"], nouvelles])
+        etat["rollup"] = fusionner_rollups(table, etat["rollup"], construire_rollup(table, nouvelles))
+        etat["version"] += 1
+
+def params_delta(etat):
+    """Filtre PostgREST ne renvoyant que les lignes postérieures au dernier point de synchro"""
+    if etat["dernier_id"] is not None:
+        return {"id": f"gt.{etat['dernier_id']}", "order": "id.asc"}
+    if etat["dernier_created_at"] is not None:
+        return {"created_at": f"gt.{etat['dernier_created_at'].isoformat()}", "order": "created_at.asc"}
+    return {}
+
+def maj_point_synchro(etat, df):
+    """Avance le point de synchro au plus grand id / created_at reçu de Supabase.
+    
+    Les lignes ajoutées par écriture directe ne le déplacent pas : une insertion
+    concurrente d'id inférieur serait sinon ignorée par le prochain delta.
+    """
+    if 'id' in df.columns and df['id'].notna().any():
+        dernier_id = int(pd.to_numeric(df['id'], errors='coerce').max())
+        etat["dernier_id"] = max(dernier_id, etat["dernier_id"] or dernier_id)
+    if 'created_at' in df.columns and df['created_at'].notna().any():
+        dernier = df['created_at'].max()
+        if etat["dernier_created_at"] is None or dernier > etat["dernier_created_at"]:
+            etat["dernier_created_at"] = dernier
+
+def telecharger_table(table, params, session):
+    """Télécharge une table page par page et construit le DataFrame au fil des pages.
+    
+    Pagination par clé sur `id` (ou limit/offset pour un delta trié sur created_at).
+    Exécutée dans un thread : aucun appel Streamlit ici, l'erreur est renvoyée.
+    """
+    params = dict(params)
+    params.setdefault("order", "id.asc")
+    par_id = params["order"] == "id.asc"
+    
+    pages = []
+    offset = 0
+    while True:
+        page_params = {**params, "limit": PAGE_SIZE}
+        if not par_id:
+            page_params["offset"] = offset
+        response = supabase_get(table, page_params, session=session, headers={"Accept": "text/csv"})
+        
+        if response.status_code != 200:
+            return None, f"Erreur {response.status_code} lors du chargement de {table}"
+        
+        page = decoder_csv(table, response.content)
+        if not page.empty:
+            # Colonnes dérivées page par page
+            pages.append(preparer_table(table, page))
+        if len(page) < PAGE_SIZE:
+            break
+        
+        if par_id:
+            params["id"] = f"gt.{int(page['id'].iloc[-1])}"
+        else:
+            offset += len(page)
+    
+    if not pages:
+        return preparer_table(table, pd.DataFrame(columns=COLONNES[table])), None
+    return concatener(table, pages), None
+
+def telecharger_tables(params_par_table, session=None):
+    """Télécharge plusieurs tables en parallèle sur le pool de threads"""
+    session = session or get_supabase_session()
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCE) as pool:
+        taches = {
+            table: pool.submit(telecharger_table, table, params, session)
+            for table, params in params_par_table.items()
+        }
+    return {table: tache.result() for table, tache in taches.items()}
+
+def sonder_table(table, session):
+    """Nombre de lignes et id maximal côté serveur, sans télécharger la table.
+    
+    Une seule ligne demandée ; le total vient de l'en-tête Content-Range (Prefer: count=exact).
+    Retourne None si la sonde échoue : la table est alors synchronisée normalement.
+    """
+    response = supabase_get(table, {"select": "id", "order": "id.desc", "limit": 1},
+                            session=session, headers={"Prefer": "count=exact"})
+    plage = response.headers.get("Content-Range", "")
+    if response.status_code not in (200, 206) or "/" not in plage or plage.endswith("*"):
+        return None
+    lignes = response.json()
+    return int(plage.rsplit("/", 1)[1]), (lignes[0]["id"] if lignes else None)
+
+def sonder_tables(tables, session):
+    """Sondes en parallèle, une par table"""
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCE) as pool:
+        taches = {table: pool.submit(sonder_table, table, session) for table in tables}
+    resultats = {}
+    for table, tache in taches.items():
+        try:
+            resultats[table] = tache.result()
+        except Exception:
+            resultats[table] = None
+    return resultats
+
+def synchroniser_tables(store, session=None):
+    """Télécharge le delta de chaque table hors verrou, puis l'intègre sous verrou.
+    
+    Exécutée par le thread de rafraîchissement : aucun appel Streamlit, les erreurs
+    sont conservées dans store["erreurs"]. Un rechargement complet construit un nouvel
+    état échangé d'un bloc : les pages ne voient jamais de table à moitié chargée.
+    """
+    incremental = {}
+    locales = {}
+    with store["lock"]:
+        for table in TABLES:
+            df = store["tables"][table]["df"]
+            incremental[table] = SYNC_INCREMENTALE and df is not None
+            if incremental[table]:
+                locales[table] = (len(df), int(df["id"].max()) if not df.empty else None)
+    
+    # Sondes : une table dont le nombre de lignes et l'id max n'ont pas bougé n'est pas
+    # retéléchargée ; un nombre de lignes différent à id max égal signale des suppressions
+    if SYNC_SONDES and locales:
+        for table, sonde in sonder_tables(list(locales), session).items():
+            if sonde is None:
+                continue
+            if sonde == locales[table]:
+                store["sondes"][table]["inchangee"] += 1
+                incremental[table] = None
+                continue
+            store["sondes"][table]["modifiee"] += 1
+            nb_distant, id_max_distant = sonde
+            nb_local, id_max_local = locales[table]
+            if id_max_distant == id_max_local or nb_distant < nb_local:
+                incremental[table] = False  # Lignes supprimées : rechargement complet
+    
+    params_par_table = {}
+    with store["lock"]:
+        for table in TABLES:
+            if incremental[table] is None:
+                continue
+            params = {"select": ",".join(COLONNES[table])}
+            if incremental[table]:
+                params.update(params_delta(store["tables"][table]))
+            params_par_table[table] = params
+    
+    resultats = telecharger_tables(params_par_table, session) if params_par_table else {}
+    
+    with store["lock"]:
+        for table, (nouvelles, erreur) in resultats.items():
+            if erreur is not None:
+                store["erreurs"][table] = erreur
+                continue
+            store["erreurs"].pop(table, None)
+            
+            # Debug: colonnes disponibles
+            if not nouvelles.empty or not incremental[table]:
+                store["colonnes"][table] = nouvelles.columns.tolist()
+            
+            etat = store["tables"][table]
+            if not incremental[table]:
+                nouvel_etat = etat_vide()
+                ajouter_lignes(nouvel_etat, table, nouvelles)
+                maj_point_synchro(nouvel_etat, nouvelles)
+                # Versions croissantes : les partitions en cache restent valides par version
+                nouvel_etat["version"] = etat["version"] + 1
+                nouvel_etat["version_snapshot"] = etat["version_snapshot"]
+                store["tables"][table] = nouvel_etat
+                continue
+            # Le delta contient toutes les lignes au-delà du point de synchro, y compris
+            # celles déjà ajoutées par écriture directe : il fait avancer ce point
+            maj_point_synchro(etat, nouvelles)
+            if etat["ids_ecrits"] and 'id' in nouvelles.columns:
+                # Ignorer les lignes déjà ajoutées par écriture directe
+                deja_la = nouvelles['id'].isin(etat["ids_ecrits"])
+                etat["ids_ecrits"].difference_update(nouvelles.loc[deja_la, 'id'])
+                nouvelles = nouvelles[~deja_la]
+            ajouter_lignes(etat, table, nouvelles)
+
+def rafraichir(store, session=None):
+    """Une synchronisation complète : delta des tables puis snapshot disque si dû"""
+    with store["synchro_lock"]:
+        try:
+            synchroniser_tables(store, session)
+            store["derniere_synchro"] = time()
+            store["erreurs"].pop("synchro", None)
+        except Exception as e:
+            store["erreurs"]["synchro"] = f"Erreur lors du chargement des données: {str(e)}"
+        # Même en erreur : les pages affichent ce qui est disponible plutôt que d'attendre
+        store["pret"].set()
+        sauver_snapshots(store)
+
+@st.cache_resource
+def get_rafraichisseur():
+    """Thread unique par processus resynchronisant la copie locale toutes les SYNC_TTL secondes.
+    
+    Les pages lisent la dernière copie complète sans attendre le réseau ;
+    le bouton Actualiser réveille simplement ce thread.
+    """
+    rafraichisseur = {"reveil": threading.Event()}
+    store = get_table_store()
+    session = get_supabase_session()
+    
+    def boucle():
+        while True:
+            rafraichir(store, session)
+            rafraichisseur["reveil"].wait(SYNC_TTL_DIRECT if store["direct"] else SYNC_TTL)
+            rafraichisseur["reveil"].clear()
+    
+    rafraichisseur["thread"] = threading.Thread(target=boucle, daemon=True, name="vacpa-rafraichissement")
+    rafraichisseur["thread"].start()
+    return rafraichisseur
+
+# --------------------------
+# 💾 SNAPSHOTS DISQUE
+# --------------------------
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshots")
+SNAPSHOT_META = os.path.join(SNAPSHOT_DIR, "synchro.json")
+SNAPSHOT_INTERVALLE = 300  # Secondes minimum entre deux écritures
+
+def chemin_snapshot(table):
+    return os.path.join(SNAPSHOT_DIR, f"{table}.parquet")
+
+def charger_snapshots(store):
+    """Recharge les tables typées depuis Parquet (mappé en mémoire) avec leur point de synchro"""
+    if pq is None or not os.path.exists(SNAPSHOT_META):
+        return
+    try:
+        with open(SNAPSHOT_META, encoding="utf-8") as f:
+            meta = json.load(f)
+        for table in TABLES:
+            if table not in meta or not os.path.exists(chemin_snapshot(table)):
+                continue
+            df = pq.read_table(chemin_snapshot(table), memory_map=True).to_pandas()
+            # Anciens snapshots : niveau_rendement n'est plus stocké (dérivé des seuils)
+            df = df.drop(columns=["niveau_rendement"], errors="ignore")
+            if not set(COLONNES[table]) <= set(df.columns):
+                continue  # Manifeste de colonnes modifié : rechargement complet
+            
+            etat = store["tables"][table]
+            ajouter_lignes(etat, table, df)
+            etat["version_snapshot"] = etat["version"]
+            etat["dernier_id"] = meta[table]["dernier_id"]
+            if meta[table]["dernier_created_at"]:
+                etat["dernier_created_at"] = pd.Timestamp(meta[table]["dernier_created_at"])
+            etat["ids_ecrits"] = set(meta[table]["ids_ecrits"])
+        store["derniere_synchro"] = os.path.getmtime(SNAPSHOT_META)
+        if all(etat["df"] is not None for etat in store["tables"].values()):
+            store["pret"].set()
+    except Exception:
+        # Snapshot illisible ou incohérent : repartir d'une copie vide
+        store["tables"] = {table: etat_vide() for table in TABLES}
+
+def ecrire_atomique(chemin, ecrire):
+    """Écrit via un fichier temporaire puis le renomme : jamais de snapshot à moitié écrit"""
+    temporaire = chemin + ".tmp"
+    ecrire(temporaire)
+    os.replace(temporaire, chemin)
+
+def sauver_snapshots(store):
+    """Écrit les tables modifiées et leur point de synchro.
+    
+    Seules les références sont prises sous verrou : les DataFrames sont remplacés, jamais
+    modifiés en place, donc l'écriture Parquet se fait hors verrou sans bloquer les pages.
+    """
+    if pq is None or time() - store["dernier_snapshot"] < SNAPSHOT_INTERVALLE:
+        return
+    with store["lock"]:
+        etats = {
+            table: {
+                "df": etat["df"],
+                "version": etat["version"],
+                "modifiee": etat["version"] != etat["version_snapshot"],
+                "dernier_id": etat["dernier_id"],
+                "dernier_created_at": etat["dernier_created_at"],
+                "ids_ecrits": list(etat["ids_ecrits"])
+            }
+            for table, etat in store["tables"].items() if etat["df"] is not None
+        }
+    modifiees = [table for table, etat in etats.items() if etat["modifiee"]]
+    if not modifiees:
+        return
+    
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        for table in modifiees:
+            donnees = pa.Table.from_pandas(etats[table]["df"], preserve_index=False)
+            ecrire_atomique(chemin_snapshot(table), lambda chemin: pq.write_table(donnees, chemin))
+        
+        meta = {
+            table: {
+                "dernier_id": etat["dernier_id"],
+                "dernier_created_at": etat["dernier_created_at"].isoformat() if etat["dernier_created_at"] is not None else None,
+                "ids_ecrits": [int(i) for i in etat["ids_ecrits"]]
+            }
+            for table, etat in etats.items()
+        }
+        
+        def ecrire_meta(chemin):
+            with open(chemin, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        ecrire_atomique(SNAPSHOT_META, ecrire_meta)
+        store["dernier_snapshot"] = time()
+        
+        with store["lock"]:
+            for table in modifiees:
+                # Version écrite : une table modifiée entre-temps sera réécrite au prochain cycle
+                store["tables"][table]["version_snapshot"] = etats[table]["version"]
+    except Exception as e:
+        store["erreurs"]["snapshot"] = f"Snapshot des données non enregistré: {str(e)}"
+
 def charger_donnees():
+    """Dernière copie complète des tables, lue immédiatement (resynchronisée en arrière-plan).
+    
+    Seul le tout premier chargement sans snapshot attend la première synchronisation.
+    """
+    store = get_table_store()
+    get_rafraichisseur()
+    store["pret"].wait(PREMIER_CHARGEMENT_DELAI)
+    
+    # Copies superficielles : les colonnes ajoutées par les vues ne modifient pas la copie partagée
     dfs = {}
+    with store["lock"]:
+        for table in TABLES:
+            df = store["tables"][table]["df"]
+            dfs[table] = df.copy(deep=False) if df is not None else pd.DataFrame()
+        for table, colonnes in store["colonnes"].items():
+            st.session_state[f'debug_{table}_columns'] = colonnes
+    return dfs
+
+def afficher_etat_synchro():
+    """Âge de la copie affichée et erreurs de la dernière synchronisation"""
+    store = get_table_store()
+    for erreur in list(store["erreurs"].values()):
+        st.warning(erreur)
+    if store["derniere_synchro"]:
+        age = int(time() - store["derniere_synchro"])
+        libelle = f"{age} s" if age < 120 else f"{age // 60} min"
+        st.caption(f"🕒 Données synchronisées il y a {libelle} (actualisation automatique toutes les {SYNC_TTL} s)")
+    else:
+        st.caption("🕒 Première synchronisation en cours…")
+
+def appliquer_insertion(table, lignes):
+    """Écriture directe : ajoute au cache de la table les lignes renvoyées par PostgREST.
+    
+    Seules ces lignes sont typées et dérivées ; les autres tables ne sont pas touchées.
+    Une même ligne peut arriver par l'écriture et par le flux direct : elle n'est ajoutée qu'une fois.
+    """
+    if not lignes:
+        return
+    nouvelles = pd.DataFrame(lignes)
+    nouvelles = preparer_table(table, nouvelles[[c for c in COLONNES[table] if c in nouvelles.columns]])
+    
+    store = get_table_store()
+    with store["lock"]:
+        etat = store["tables"][table]
+        if etat["df"] is not None:
+            if 'id' in nouvelles.columns:
+                deja_la = nouvelles['id'].isin(etat["ids_ecrits"])
+                if etat["dernier_id"] is not None:
+                    deja_la |= nouvelles['id'] <= etat["dernier_id"]
+                nouvelles = nouvelles[~deja_la]
+            ajouter_lignes(etat, table, nouvelles)
+            if 'id' in nouvelles.columns:
+                etat["ids_ecrits"].update(nouvelles['id'].dropna())
+    
+    # Seules les plages contenant la date d'une nouvelle ligne sont retéléchargées
+    if nouvelles.empty:
+        return
+    if 'created_at' in nouvelles.columns and nouvelles['created_at'].notna().all():
+        invalider_periodes(set(nouvelles['created_at'].dt.date))
+    else:
+        invalider_periodes()
+    if table == TABLE_RENDEMENT:
+        invalider_annuaire()
+        enregistrer_numeros_pesees(nouvelles)
+
+# --------------------------
+# 📡 FLUX DIRECT (SUPABASE REALTIME)
+# --------------------------
+# Les insertions sont poussées par Realtime et appliquées à la copie locale dès réception ;
+# la synchronisation périodique reste le filet de sécurité (espacée tant que le flux tient).
+# Supabase n'émet ces événements que pour les tables de la publication supabase_realtime :
+# voir migrations/002_publication_realtime.sql (prérequis du mode direct).
+# VACPA_REALTIME_URL permet de pointer vers un serveur websocket local pour les essais.
+REALTIME_URL = os.environ.get(
+    "VACPA_REALTIME_URL",
+    SUPABASE_URL.replace("https://", "wss://") + f"/realtime/v1/websocket?apikey={SUPABASE_KEY}&vsn=1.0.0"
+)
+REALTIME_HEARTBEAT = 25  # Secondes entre deux battements Phoenix
+REALTIME_RECONNEXION = 10  # Secondes avant une nouvelle tentative de connexion
+DIRECT_INTERVALLE = 5  # Secondes entre deux rafraîchissements des cartes en mode direct
+
+def message_abonnement():
+    """Message phx_join abonnant le canal aux insertions des trois tables"""
+    return json.dumps({
+        "topic": "realtime:vacpa",
+        "event": "phx_join",
+        "ref": "1",
+        "payload": {
+            "config": {"postgres_changes": [
+                {"event": "INSERT", "schema": "public", "table": table} for table in TABLES
+            ]},
+            "access_token": SUPABASE_KEY
+        }
+    })
+
+def erreur_canal(message):
+    """Motif de refus ou de fermeture du canal dans un message Realtime, None sinon.
+    
+    Couvre la réponse au phx_join (ref "1"), la fermeture du canal et le message
+    "system" envoyé quand l'abonnement aux changements Postgres échoue.
+    """
+    evenement = message.get("event")
+    payload = message.get("payload") or {}
+    if evenement == "phx_reply" and message.get("ref") == "1" and payload.get("status") != "ok":
+        return f"Abonnement Realtime refusé : {payload.get('response')}"
+    if evenement in ("phx_error", "phx_close"):
+        return f"Canal Realtime fermé ({evenement})"
+    if evenement == "system" and payload.get("status") == "error":
+        return f"Abonnement Realtime en erreur : {payload.get('message')}"
+    return None
+
+def attendre_abonnement(ws):
+    """Attend l'accusé du phx_join ; lève une erreur si le canal est refusé ou ne répond pas"""
+    limite = time() + REALTIME_HEARTBEAT
+    while time() < limite:
+        brut = ws.recv()
+        if not brut:
+            raise ConnectionError("Connexion Realtime fermée")
+        message = json.loads(brut)
+        erreur = erreur_canal(message)
+        if erreur is not None:
+            raise ConnectionError(erreur)
+        if message.get("event") == "phx_reply" and message.get("ref") == "1":
+            return
+    raise TimeoutError("Pas de réponse à l'abonnement Realtime")
+
+def evenement_insertion(message):
+    """(table, ligne) d'un message Realtime d'insertion, None pour tout autre message"""
+    if message.get("event") != "postgres_changes":
+        return None
+    donnees = message.get("payload", {}).get("data", {})
+    if donnees.get("type") != "INSERT" or donnees.get("table") not in TABLES:
+        return None
+    return donnees["table"], donnees.get("record") or {}
+
+@st.cache_resource
+def get_flux_direct():
+    """Thread unique par processus écoutant Realtime ; reconnexion automatique.
+    
+    Sans websocket-client, le flux reste indisponible et seule la synchronisation
+    périodique alimente la copie locale.
+    """
+    flux = {"etat": "indisponible", "evenements": 0, "derniere_erreur": None}
+    if websocket is None:
+        return flux
+    store = get_table_store()
+    reveil_synchro = get_rafraichisseur()["reveil"]
+    
+    def ecouter():
+        ws = websocket.create_connection(REALTIME_URL, timeout=REALTIME_HEARTBEAT)
+        try:
+            ws.send(message_abonnement())
+            # Connecté seulement une fois le canal accepté : sinon la synchro garde SYNC_TTL
+            attendre_abonnement(ws)
+            ws.settimeout(DIRECT_INTERVALLE)
+            flux["etat"] = "connecte"
+            store["direct"] = True
+            reveil_synchro.set()  # Rattrape ce qui a pu être manqué pendant la déconnexion
+            dernier_battement = time()
+            ref = 1
+            while True:
+                if time() - dernier_battement >= REALTIME_HEARTBEAT:
+                    ref += 1
+                    ws.send(json.dumps({"topic": "phoenix", "event": "heartbeat", "payload": {}, "ref": str(ref)}))
+                    dernier_battement = time()
+                try:
+                    brut = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    continue
+                if not brut:
+                    raise ConnectionError("Connexion Realtime fermée")
+                message = json.loads(brut)
+                erreur = erreur_canal(message)
+                if erreur is not None:
+                    raise ConnectionError(erreur)
+                evenement = evenement_insertion(message)
+                if evenement is not None:
+                    table, ligne = evenement
+                    appliquer_insertion(table, [ligne])
+                    flux["evenements"] += 1
+        finally:
+            ws.close()
+    
+    def boucle():
+        while True:
+            try:
+                ecouter()
+            except Exception as e:
+                flux["derniere_erreur"] = str(e)
+            flux["etat"] = "deconnecte"
+            store["direct"] = False
+            sleep(REALTIME_RECONNEXION)
+    
+    flux["etat"] = "connexion"
+    flux["thread"] = threading.Thread(target=boucle, daemon=True, name="vacpa-flux-direct")
+    flux["thread"].start()
+    return flux
+
+def afficher_etat_flux(flux):
+    """Statut du flux direct (barre latérale)"""
+    if flux["etat"] == "connecte":
+        st.caption(f"🟢 Flux direct connecté ({flux['evenements']} insertion(s) reçue(s))")
+    elif flux["etat"] == "indisponible":
+        st.caption(f"⚪ Flux direct indisponible (websocket-client absent) : actualisation toutes les {SYNC_TTL} s")
+    else:
+        st.caption(f"🟠 Flux direct en reconnexion : actualisation toutes les {SYNC_TTL} s")
+
+# --------------------------
+# 👥 ANNUAIRE DES OPÉRATRICES
+# --------------------------
+ANNUAIRE_TTL = 300  # Secondes avant reconstruction, même sans nouvelle pesée
+OPERATRICES_DEFAUT = ["operateur", "marwa"]
+
+# Colonne de tri (du plus récent au plus ancien) des vues par opératrice
+TRI_PARTITIONS = {
+    TABLE_RENDEMENT: "date",
+    TABLE_PANNES: "date_heure",
+    TABLE_ERREURS: "date_heure"
+}
+
+@st.cache_resource
+def get_partitions():
+    """Vues par opératrice de chaque table, partagées par toutes les sessions"""
+    return {
+        "lock": threading.Lock(),
+        "tables": {table: {"version": None, "parts": {}} for table in TABLES}
+    }
+
+def partitions_operatrices(table):
+    """dict opératrice -> DataFrame de ses lignes, trié du plus récent au plus ancien.
+    
+    Le découpage est refait une fois par version de la copie locale : chaque session
+    lit ensuite sa partition sans parcourir les données des autres opératrices.
+    """
+    store = get_table_store()
+    with store["lock"]:
+        etat = store["tables"][table]
+        df, version = etat["df"], etat["version"]
+    
+    partitions = get_partitions()
+    with partitions["lock"]:
+        courant = partitions["tables"][table]
+        if courant["version"] != version:
+            parts = {}
+            if df is not None and not df.empty and 'operatrice_id' in df.columns:
+                tri = TRI_PARTITIONS[table]
+                if tri in df.columns:
+                    df = df.sort_values(tri, ascending=False, kind="stable")
+                parts = dict(tuple(df.groupby('operatrice_id', observed=True, sort=True)))
+            partitions["tables"][table] = {"version": version, "parts": parts}
+        return partitions["tables"][table]["parts"]
+
+def lignes_operatrice(table, operatrice_id):
+    """Lignes d'une opératrice (plus récentes d'abord), sans parcourir toute la table"""
+    part = partitions_operatrices(table).get(operatrice_id)
+    if part is None:
+        return pd.DataFrame(columns=COLONNES[table])
+    return part
+
+@st.cache_resource
+def get_annuaire():
+    """Annuaire partagé par le processus : liste des opératrices connues"""
+    return {"lock": threading.Lock(), "expire": 0.0, "operatrices": []}
+
+def invalider_annuaire():
+    """Force la reconstruction de l'annuaire (nouvelle pesée)"""
+    annuaire = get_annuaire()
+    with annuaire["lock"]:
+        annuaire["expire"] = 0.0
+
+def annuaire_operatrices():
+    """Liste triée des opératrices, tirée des partitions des rendements (TTL ANNUAIRE_TTL)"""
+    annuaire = get_annuaire()
+    with annuaire["lock"]:
+        if time() >= annuaire["expire"]:
+            annuaire["operatrices"] = list(partitions_operatrices(TABLE_RENDEMENT))
+            annuaire["expire"] = time() + ANNUAIRE_TTL
+        return annuaire["operatrices"]
+
+# --------------------------
+# ⚖️ INSERTION DES PESÉES
+# --------------------------
+# L'unicité (opératrice, jour, numéro) est garantie par une contrainte en base, créée par
+# migrations/001_ecritures_idempotentes.sql (prérequis). Si la migration manque, les
+# écritures passent en insertion simple plutôt que d'être rejetées.
+CLE_PESEE = ["operatrice_id", "date", "numero_pesee"]
+MESSAGE_PESEE_EXISTANTE = "Une pesée avec ce numéro existe déjà pour aujourd'hui. Veuillez utiliser un numéro différent."
+
+def pesee_existe(operatrice_id, jour, numero_pesee):
+    """Équivalent local de la contrainte, sur la copie synchronisée (aucun appel réseau)"""
+    df = lignes_operatrice(TABLE_RENDEMENT, operatrice_id)
+    if df.empty:
+        return False
+    return bool(((df["date"].dt.date == jour) & (df["numero_pesee"] == numero_pesee)).any())
+
+@st.cache_resource
+def get_compteurs_pesees():
+    """Dernier numéro de pesée connu par (opératrice, jour), partagé par les postes de pesée"""
+    return {"lock": threading.Lock(), "version": None, "derniers": {}}
+
+def prochain_numero_pesee(operatrice_id, jour):
+    """Prochain numéro libre pour (opératrice, jour), amorcé depuis la copie synchronisée"""
+    store = get_table_store()
+    version = store["tables"][TABLE_RENDEMENT]["version"]
     
+    compteurs = get_compteurs_pesees()
+    with compteurs["lock"]:
+        # Nouvelles pesées synchronisées (autres postes) : réamorcer depuis la copie
+        if compteurs["version"] != version:
+            compteurs["derniers"].clear()
+            compteurs["version"] = version
+        
+        cle = (operatrice_id, jour)
+        if cle not in compteurs["derniers"]:
+            df = lignes_operatrice(TABLE_RENDEMENT, operatrice_id)
+            numeros = df.loc[df["date"].dt.date == jour, "numero_pesee"] if not df.empty else pd.Series(dtype=float)
+            compteurs["derniers"][cle] = max(
+                int(numeros.max()) if numeros.notna().any() else 0,
+                dernier_numero_en_attente(operatrice_id, jour)
+            )
+        return compteurs["derniers"][cle] + 1
+
+def enregistrer_numeros_pesees(df):
+    """Avance les compteurs avec des pesées insérées avec succès"""
+    if df.empty or not set(CLE_PESEE) <= set(df.columns):
+        return
+    compteurs = get_compteurs_pesees()
+    with compteurs["lock"]:
+        for operatrice_id, jour, numero in zip(df["operatrice_id"], df["date"].dt.date, df["numero_pesee"]):
+            if pd.notna(numero):
+                cle = (operatrice_id, jour)
+                compteurs["derniers"][cle] = max(compteurs["derniers"].get(cle, 0), int(numero))
+
+# Réponses PostgREST quand la migration n'est pas appliquée : pas de contrainte pour
+# ON CONFLICT (42P10) ou colonne cle_idempotence inconnue (PGRST204, 42703)
+CODES_SCHEMA_MANQUANT = {"42P10", "PGRST204", "42703"}
+
+@st.cache_resource
+def get_tables_sans_migration():
+    """Tables où la migration manque, écrites en insertion simple (partagé par le processus)"""
+    return set()
+
+def schema_manquant(response):
+    """La requête a-t-elle échoué parce que la migration n'est pas appliquée ?"""
+    if response.status_code != 400:
+        return False
+    try:
+        return response.json().get("code") in CODES_SCHEMA_MANQUANT
+    except ValueError:
+        return False
+
+def inserer_idempotent(table, lignes, on_conflict, session=None):
+    """POST groupé dont les doublons sur `on_conflict` sont écartés par la base.
+    
+    Sans la migration, bascule en insertion simple sans cle_idempotence : les données
+    sont écrites au lieu d'être rejetées, et le panneau de diagnostic le signale.
+    """
+    sans_migration = get_tables_sans_migration()
+    if table not in sans_migration:
+        response = supabase_post(
+            table,
+            lignes,
+            session=session,
+            params={"on_conflict": on_conflict},
+            headers={"Prefer": "return=representation,resolution=ignore-duplicates"}
+        )
+        if not schema_manquant(response):
+            return response
+        sans_migration.add(table)
+    lignes = [{k: v for k, v in ligne.items() if k != "cle_idempotence"} for ligne in lignes]
+    return supabase_post(table, lignes, session=session)
+
+def inserer_pesees(lignes, session=None):
+    """Insère une ou plusieurs pesées en une requête, les doublons étant écartés par la base.
+    
+    Retourne (lignes insérées, erreur, code HTTP) ; une ligne absente de la réponse était un doublon.
+    """
+    response = inserer_idempotent(TABLE_RENDEMENT, lignes, ",".join(CLE_PESEE), session=session)
+    if response.status_code == 409:
+        return [], MESSAGE_PESEE_EXISTANTE, response.status_code
+    if response.status_code != 201:
+        return [], f"Erreur {response.status_code}: {response.text}", response.status_code
+    return response.json(), None, response.status_code
+
+# --------------------------
+# 📥 FILE D'ATTENTE DES ÉCRITURES
+# --------------------------
+# Pesées et signalements sont d'abord journalisés sur disque (SQLite), puis envoyés
+# par lots à Supabase par un thread de fond : une coupure réseau ne perd plus rien.
+# Chaque écriture porte une clé d'idempotence pour être renvoyée sans doublon
+# (colonnes créées par migrations/001_ecritures_idempotentes.sql).
+FILE_ATTENTE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "file_attente.sqlite3")
+FLUSH_INTERVALLE = 5  # Secondes entre deux envois
+FLUSH_LOT = 200  # Lignes maximum par insertion groupée
+FILE_ATTENTE_RETENTION_JOURS = 7  # Conservation des écritures synchronisées
+
+@st.cache_resource
+def init_file_attente():
+    """Crée le journal des écritures (une fois par processus)"""
+    conn = sqlite3.connect(FILE_ATTENTE_DB, timeout=10)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ecritures (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cle TEXT UNIQUE NOT NULL,
+                table_cible TEXT NOT NULL,
+                donnees TEXT NOT NULL,
+                auteur TEXT,
+                statut TEXT NOT NULL DEFAULT 'en_attente',
+                tentatives INTEGER NOT NULL DEFAULT 0,
+                erreur TEXT,
+                cree_le REAL NOT NULL,
+                synchronise_le REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ecritures_statut ON ecritures (statut, id)")
+        conn.commit()
+    finally:
+        conn.close()
+    return FILE_ATTENTE_DB
+
+@contextmanager
+def connexion_file():
+    """Connexion SQLite courte (une par appel, utilisable depuis n'importe quel thread)"""
+    conn = sqlite3.connect(init_file_attente(), timeout=10)
     try:
-        # Chargement des données depuis Supabase
-        for table in [TABLE_RENDEMENT, TABLE_PANNES, TABLE_ERREURS]:
-            response = requests.get(f"{SUPABASE_URL}/rest/v1/{table}?select=*", headers=headers)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def mettre_en_attente(table, data, auteur):
+    """Journalise une écriture et réveille le thread d'envoi ; retourne la clé d'idempotence"""
+    cle = str(uuid.uuid4())
+    data = {**data, "cle_idempotence": cle}
+    with connexion_file() as conn:
+        conn.execute(
+            "INSERT INTO ecritures (cle, table_cible, donnees, auteur, cree_le) VALUES (?, ?, ?, ?, ?)",
+            (cle, table, json.dumps(data), auteur, time())
+        )
+    if table == TABLE_RENDEMENT:
+        # Le formulaire propose aussitôt le numéro suivant, sans attendre l'envoi
+        enregistrer_numeros_pesees(pd.DataFrame({
+            "operatrice_id": [data["operatrice_id"]],
+            "date": pd.to_datetime([data["date"]]),
+            "numero_pesee": [data["numero_pesee"]]
+        }))
+    get_flusher()["reveil"].set()
+    return cle
+
+def pesee_en_attente(operatrice_id, jour, numero_pesee):
+    """Une pesée de même clé attend-elle encore son envoi ?"""
+    with connexion_file() as conn:
+        ligne = conn.execute("""
+            SELECT 1 FROM ecritures
+            WHERE table_cible = ? AND statut = 'en_attente'
+              AND json_extract(donnees, '$.operatrice_id') = ?
+              AND json_extract(donnees, '$.date') = ?
+              AND json_extract(donnees, '$.numero_pesee') = ?
+            LIMIT 1
+        """, (TABLE_RENDEMENT, operatrice_id, jour.isoformat(), int(numero_pesee))).fetchone()
+    return ligne is not None
+
+def dernier_numero_en_attente(operatrice_id, jour):
+    """Plus grand numéro de pesée en attente d'envoi pour (opératrice, jour), 0 sinon"""
+    with connexion_file() as conn:
+        (numero,) = conn.execute("""
+            SELECT MAX(json_extract(donnees, '$.numero_pesee')) FROM ecritures
+            WHERE table_cible = ? AND statut = 'en_attente'
+              AND json_extract(donnees, '$.operatrice_id') = ?
+              AND json_extract(donnees, '$.date') = ?
+        """, (TABLE_RENDEMENT, operatrice_id, jour.isoformat())).fetchone()
+    return int(numero or 0)
+
+def cle_pesee_existante(pesee, session):
+    """Clé d'idempotence de la pesée déjà en base avec la même (opératrice, jour, numéro).
+    
+    Retourne (trouvée, clé) ; trouvée vaut None si la base n'a pas pu être interrogée.
+    """
+    response = supabase_get(TABLE_RENDEMENT, {
+        "select": "cle_idempotence",
+        "operatrice_id": f"eq.{pesee['operatrice_id']}",
+        "date": f"eq.{pesee['date']}",
+        "numero_pesee": f"eq.{int(pesee['numero_pesee'])}",
+        "limit": 1
+    }, session=session)
+    if response.status_code != 200:
+        return None, None
+    lignes = response.json()
+    return bool(lignes), (lignes[0].get("cle_idempotence") if lignes else None)
+
+def envoyer_lot(table, entrees, session):
+    """Insère un lot en une requête ; retourne {cle: (statut, erreur)} et les lignes insérées.
+    
+    Les doublons sont écartés par la base (on_conflict) : renvoyer un lot déjà
+    partiellement inséré est sans effet.
+    """
+    donnees = [json.loads(d) for _, _, d, _ in entrees]
+    if table == TABLE_RENDEMENT:
+        inserees, erreur, statut_http = inserer_pesees(donnees, session=session)
+    else:
+        response = inserer_idempotent(table, donnees, "cle_idempotence", session=session)
+        statut_http = response.status_code
+        inserees, erreur = (response.json(), None) if statut_http == 201 else ([], f"Erreur {statut_http}: {response.text}")
+    
+    if erreur is not None:
+        return {cle: ("erreur", erreur) for _, cle, _, _ in entrees}, [], statut_http
+    
+    # Lignes absentes de la réponse : doublon d'un envoi précédent de la même écriture,
+    # ou (pesée) numéro déjà pris par un autre poste — la clé de la ligne en base tranche
+    resultats = {}
+    if table != TABLE_RENDEMENT:
+        for _, cle, _, _ in entrees:
+            resultats[cle] = ("synchronise", None)
+        return resultats, inserees, statut_http
+    
+    presentes = {(r["operatrice_id"], str(r["date"]), int(r["numero_pesee"])) for r in inserees}
+    for (_, cle, _, _), d in zip(entrees, donnees):
+        if (d["operatrice_id"], d["date"], int(d["numero_pesee"])) in presentes:
+            resultats[cle] = ("synchronise", None)
+            continue
+        trouvee, cle_en_base = cle_pesee_existante(d, session)
+        if trouvee is None:
+            resultats[cle] = ("erreur", "Vérification du doublon impossible, nouvel essai au prochain envoi")
+        elif cle_en_base == cle:
+            resultats[cle] = ("synchronise", None)  # Envoi précédent arrivé, réponse perdue
+        else:
+            resultats[cle] = ("rejete", MESSAGE_PESEE_EXISTANTE)
+    return resultats, inserees, statut_http
+
+def vider_file_attente(session):
+    """Envoie les écritures en attente par lots, table par table"""
+    with connexion_file() as conn:
+        en_attente = conn.execute(
+            "SELECT id, cle, table_cible, donnees, tentatives FROM ecritures WHERE statut = 'en_attente' ORDER BY id"
+        ).fetchall()
+    
+    for table in TABLES:
+        entrees = [(i, cle, d, n) for i, cle, t, d, n in en_attente if t == table]
+        lots = [entrees[i:i + FLUSH_LOT] for i in range(0, len(entrees), FLUSH_LOT)]
+        while lots:
+            lot = lots.pop(0)
+            try:
+                resultats, inserees, statut_http = envoyer_lot(table, lot, session)
+            except requests.RequestException as e:
+                # Réseau indisponible : tout reste en attente jusqu'au prochain cycle
+                with connexion_file() as conn:
+                    conn.executemany(
+                        "UPDATE ecritures SET tentatives = tentatives + 1, erreur = ? WHERE cle = ?",
+                        [(str(e), cle) for _, cle, _, _ in lot]
+                    )
+                return
             
-            if response.status_code == 200:
-                df = pd.DataFrame(response.json())
-                
-                # Debug: Afficher les colonnes disponibles
-                st.session_state[f'debug_{table}_columns'] = df.columns.tolist()
-                
-                # Conversions de type
-                date_columns = [col for col in df.columns if 'date' in col.lower()]
-                for col in date_columns:
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
-                
-                if 'created_at' in df.columns:
-                    df['created_at'] = pd.to_datetime(df['created_at'], errors='coerce')
-                
-                # Calculs spécifiques pour la table rendement
-                if table == TABLE_RENDEMENT:
-                    # Gestion des colonnes manquantes avec valeurs par défaut
-                    if 'poids_kg' not in df.columns:
-                        df['poids_kg'] = 0
-                    if 'heure_travail' not in df.columns:
-                        df['heure_travail'] = 5.0
-                    
-                    # Conversion numérique
-                    df["poids_kg"] = pd.to_numeric(df["poids_kg"], errors="coerce").fillna(0)
-                    df["heure_travail"] = pd.to_numeric(df["heure_travail"], errors="coerce").fillna(5.0)
-                    
-                    # Calcul du rendement
-                    df["rendement"] = df["poids_kg"] / df["heure_travail"]
-                    
-                    # Classification du rendement
-                    bins = [0, 3.5, 4.0, 4.5, float('inf')]
-                    labels = ["Critique", "Faible", "Acceptable", "Excellent"]
-                    df["niveau_rendement"] = pd.cut(df["rendement"],
-                                                  bins=bins,
-                                                  labels=labels)
-                
-                dfs[table] = df
-            else:
-                st.error(f"Erreur {response.status_code} lors du chargement de {table}")
-                dfs[table] = pd.DataFrame()  # Retourner un DataFrame vide en cas d'erreur
-                
+            # Rejet d'un lot (4xx) : renvoyer ligne par ligne pour isoler la ligne fautive
+            rejet_definitif = statut_http is not None and 400 <= statut_http < 500 and statut_http != 429
+            if rejet_definitif and len(lot) > 1:
+                lots = [[entree] for entree in lot] + lots
+                continue
+            
+            if inserees:
+                appliquer_insertion(table, inserees)
+            
+            maintenant = time()
+            with connexion_file() as conn:
+                for cle, (statut, erreur) in resultats.items():
+                    if statut == "erreur" and rejet_definitif:
+                        statut = "rejete"
+                    if statut == "erreur":
+                        conn.execute(
+                            "UPDATE ecritures SET tentatives = tentatives + 1, erreur = ? WHERE cle = ?",
+                            (erreur, cle)
+                        )
+                    else:
+                        conn.execute(
+                            "UPDATE ecritures SET statut = ?, erreur = ?, tentatives = tentatives + 1, synchronise_le = ? WHERE cle = ?",
+                            (statut, erreur, maintenant, cle)
+                        )
+    
+    with connexion_file() as conn:
+        conn.execute(
+            "DELETE FROM ecritures WHERE statut = 'synchronise' AND synchronise_le < ?",
+            (time() - FILE_ATTENTE_RETENTION_JOURS * 86400,)
+        )
+
+@st.cache_resource
+def get_flusher():
+    """Thread unique par processus envoyant la file d'attente toutes les FLUSH_INTERVALLE secondes"""
+    flusher = {"reveil": threading.Event(), "derniere_erreur": None}
+    session = get_supabase_session()
+    
+    def boucle():
+        while True:
+            flusher["reveil"].wait(FLUSH_INTERVALLE)
+            flusher["reveil"].clear()
+            try:
+                vider_file_attente(session)
+                flusher["derniere_erreur"] = None
+            except Exception as e:
+                flusher["derniere_erreur"] = str(e)
+    
+    flusher["thread"] = threading.Thread(target=boucle, daemon=True, name="vacpa-file-attente")
+    flusher["thread"].start()
+    return flusher
+
+def etat_file_attente(auteur):
+    """Nombre d'écritures par statut et derniers rejets d'un utilisateur"""
+    with connexion_file() as conn:
+        compteurs = dict(conn.execute(
+            "SELECT statut, COUNT(*) FROM ecritures WHERE auteur = ? GROUP BY statut", (auteur,)
+        ).fetchall())
+        rejets = conn.execute(
+            "SELECT table_cible, donnees, erreur FROM ecritures WHERE auteur = ? AND statut = 'rejete' ORDER BY id DESC LIMIT 5",
+            (auteur,)
+        ).fetchall()
+    return compteurs, rejets
+
+def afficher_etat_file_attente(auteur):
+    """Statut de synchronisation des saisies de l'utilisateur"""
+    compteurs, rejets = etat_file_attente(auteur)
+    en_attente = compteurs.get("en_attente", 0)
+    
+    if en_attente:
+        st.info(f"⏳ {en_attente} saisie(s) en attente de synchronisation")
+    elif compteurs.get("synchronise", 0):
+        st.caption(f"✅ {compteurs['synchronise']} saisie(s) synchronisée(s)")
+    
+    erreur = get_flusher()["derniere_erreur"]
+    if erreur and en_attente:
+        st.caption(f"Dernière erreur d'envoi : {erreur}")
+    
+    for table, donnees, message in rejets:
+        d = json.loads(donnees)
+        libelle = f"Pesée n°{d.get('numero_pesee')} du {d.get('date')}" if table == TABLE_RENDEMENT else f"Signalement ({d.get('type_erreur')})"
+        st.error(f"{libelle} rejetée : {message}")
+    if rejets and st.button("Masquer les rejets", key="masquer_rejets"):
+        with connexion_file() as conn:
+            conn.execute("UPDATE ecritures SET statut = 'rejete_vu' WHERE auteur = ? AND statut = 'rejete'", (auteur,))
+        st.rerun()
+
+# --------------------------
+# 📤 IMPORT DE PESÉES
+# --------------------------
+IMPORT_COLONNES_REQUISES = ["operatrice_id", "ligne", "poids_kg", "numero_pesee", "date"]
+IMPORT_LOT = 500  # Pesées par insertion groupée
+
+def lire_fichier_pesees(fichier):
+    """Lit un import CSV (séparateur détecté) ou Excel"""
+    if fichier.name.lower().endswith(".xlsx"):
+        return pd.read_excel(fichier)
+    return pd.read_csv(fichier, sep=None, engine="python")
+
+def valider_pesees(df):
+    """Valide un import avec les conversions de charger_donnees et écarte les doublons.
+    
+    Retourne (pesées à insérer, lignes rejetées avec leur motif).
+    """
+    df = df.rename(columns=lambda c: str(c).strip().lower())
+    manquantes = [c for c in IMPORT_COLONNES_REQUISES if c not in df.columns]
+    if manquantes:
+        raise ValueError(f"Colonnes manquantes: {manquantes}")
+    
+    # Contrôles vectorisés sur les valeurs brutes, avant les valeurs par défaut de preparer_table
+    operatrice = df["operatrice_id"].astype("string").str.strip()
+    poids = pd.to_numeric(df["poids_kg"], errors="coerce")
+    ligne = pd.to_numeric(df["ligne"], errors="coerce")
+    numero = pd.to_numeric(df["numero_pesee"], errors="coerce")
+    date = pd.to_datetime(df["date"], errors="coerce")
+    motif = pd.Series(np.select(
+        [
+            operatrice.isna() | (operatrice == ""),
+            poids.isna() | (poids <= 0),
+            ligne.isna() | (ligne % 1 != 0),
+            numero.isna() | (numero < 1) | (numero % 1 != 0),
+            date.isna()
+        ],
+        ["operatrice_id manquant", "poids_kg invalide", "ligne invalide", "numero_pesee invalide", "date invalide"],
+        default=""
+    ), index=df.index)
+    
+    brut = df
+    df = df.assign(operatrice_id=operatrice, ligne=ligne, numero_pesee=numero)
+    valides = preparer_table(TABLE_RENDEMENT, df[motif == ""].copy())
+    # Valeurs envoyées telles que lues (float64) : le float32 de SCHEMA ne sert qu'aux calculs en mémoire
+    valides["poids_kg"] = poids[valides.index].astype("float64")
+    valides["heure_travail"] = (
+        pd.to_numeric(df.loc[valides.index, "heure_travail"], errors="coerce").fillna(5.0).astype("float64")
+        if "heure_travail" in df.columns else 5.0
+    )
+    valides["numero_pesee"] = valides["numero_pesee"].astype(int)
+    valides["ligne"] = valides["ligne"].astype(int)
+    valides["date"] = valides["date"].dt.normalize()
+    
+    # Doublons dans le fichier puis dans les données déjà chargées
+    doublon_fichier = valides.duplicated(CLE_PESEE, keep="first")
+    motif[doublon_fichier[doublon_fichier].index] = "doublon dans le fichier"
+    valides = valides[~doublon_fichier]
+    
+    existantes = charger_donnees()[TABLE_RENDEMENT]
+    if not existantes.empty:
+        cles = existantes[CLE_PESEE].assign(date=existantes["date"].dt.normalize()).drop_duplicates()
+        deja_la = valides[CLE_PESEE].merge(cles, on=CLE_PESEE, how="left", indicator=True)["_merge"].eq("both").to_numpy()
+        motif[valides.index[deja_la]] = "pesée déjà enregistrée"
+        valides = valides[~deja_la]
+    
+    rejetees = brut.loc[motif != "", IMPORT_COLONNES_REQUISES].assign(motif=motif[motif != ""])
+    return valides, rejetees
+
+def importer_pesees(valides, progression):
+    """Insère les pesées validées par lots de IMPORT_LOT ; retourne (nb insérées, nb doublons, erreurs)"""
+    colonnes = ["operatrice_id", "ligne", "poids_kg", "numero_pesee", "date", "heure_travail",
+                "commentaire_pesee", "type_produit"]
+    lignes = valides.assign(
+        date=valides["date"].dt.strftime("%Y-%m-%d"),
+        created_at=datetime.now().isoformat() + "Z",
+        type_produit=valides["type_produit"] if "type_produit" in valides.columns else "marcadona"
+    )
+    lignes = lignes[[c for c in colonnes if c in lignes.columns] + ["created_at"]]
+    # Sérialisation JSON de pandas : types numpy convertis en types natifs
+    donnees = json.loads(lignes.to_json(orient="records"))
+    
+    inserees, erreurs = [], []
+    nb_acceptees = 0  # Lignes des lots acceptés par la base (insérées ou doublons ignorés)
+    session = get_supabase_session()
+    for debut in range(0, len(donnees), IMPORT_LOT):
+        lot = donnees[debut:debut + IMPORT_LOT]
+        lot_insere, erreur, _ = inserer_pesees(lot, session=session)
+        if erreur is not None:
+            erreurs.append(f"Lignes {debut + 1}-{debut + len(lot)} : {erreur}")
+        else:
+            nb_acceptees += len(lot)
+            inserees.extend(lot_insere)
+        progression.progress(min(1.0, (debut + len(lot)) / len(donnees)),
+                             text=f"{debut + len(lot)} / {len(donnees)} pesées envoyées")
+    
+    # Une seule mise à jour du cache pour tout l'import
+    appliquer_insertion(TABLE_RENDEMENT, inserees)
+    return len(inserees), nb_acceptees - len(inserees), erreurs
+
+# --------------------------
+# 📦 EXPORT
+# --------------------------
+EXPORT_BLOC = 10000  # Lignes converties à la fois
+EXPORT_PREFIXE = "vacpa_export_"
+EXPORT_RETENTION = 3600  # Secondes avant suppression d'un fichier d'export
+
+def nettoyer_exports():
+    """Supprime les exports temporaires trop anciens, y compris ceux des sessions abandonnées"""
+    limite = time() - EXPORT_RETENTION
+    with os.scandir(tempfile.gettempdir()) as entrees:
+        for entree in entrees:
+            if entree.name.startswith(EXPORT_PREFIXE):
+                try:
+                    if entree.stat().st_mtime < limite:
+                        os.remove(entree.path)
+                except OSError:
+                    pass  # Déjà supprimé par une autre session
+
+def lignes_kpis(kpis):
+    """KPIs à plat (indicateur, valeur) pour l'export"""
+    valeurs = asdict(kpis)
+    lignes = [(f"Rendement ligne {ligne} (kg/h)", valeur) for ligne, valeur in valeurs.pop("rendement_par_ligne").items()]
+    return lignes + list(valeurs.items())
+
+def blocs(df):
+    """Parcourt un DataFrame par blocs de EXPORT_BLOC lignes, valeurs prêtes à écrire"""
+    dates = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+    for debut in range(0, len(df), EXPORT_BLOC):
+        bloc = df.iloc[debut:debut + EXPORT_BLOC].copy()
+        for col in dates:
+            if bloc[col].dt.tz is not None:
+                bloc[col] = bloc[col].dt.tz_localize(None)
+        bloc = bloc.astype(object).where(bloc.notna(), None)
+        yield debut, bloc
+
+def exporter_excel(tables, kpis):
+    """Classeur multi-feuilles écrit en mode constant_memory dans un fichier temporaire.
+    
+    Les lignes sont écrites au fil de l'eau : le classeur n'est jamais tenu en mémoire.
+    """
+    nettoyer_exports()
+    fichier = tempfile.NamedTemporaryFile(prefix=EXPORT_PREFIXE, suffix=".xlsx", delete=False)
+    fichier.close()
+    
+    workbook = xlsxwriter.Workbook(fichier.name, {"constant_memory": True})
+    gras = workbook.add_format({"bold": True})
+    format_date = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm"})
+    
+    feuille = workbook.add_worksheet("KPIs")
+    feuille.write_row(0, 0, ["Indicateur", "Valeur"], gras)
+    for i, (indicateur, valeur) in enumerate(lignes_kpis(kpis), start=1):
+        feuille.write_row(i, 0, [indicateur, valeur])
+    
+    for nom, df in tables.items():
+        feuille = workbook.add_worksheet(nom[:31])
+        feuille.write_row(0, 0, [str(c) for c in df.columns], gras)
+        dates = {j for j, c in enumerate(df.columns) if pd.api.types.is_datetime64_any_dtype(df[c])}
+        for debut, bloc in blocs(df):
+            for i, valeurs in enumerate(bloc.itertuples(index=False, name=None), start=debut + 1):
+                for j, valeur in enumerate(valeurs):
+                    if valeur is None:
+                        continue
+                    if j in dates:
+                        feuille.write_datetime(i, j, valeur.to_pydatetime(), format_date)
+                    else:
+                        feuille.write(i, j, valeur if isinstance(valeur, (int, float, str)) else str(valeur))
+    
+    workbook.close()
+    return fichier.name
+
+def exporter_csv(df):
+    """CSV écrit par blocs dans un fichier temporaire"""
+    nettoyer_exports()
+    fichier = tempfile.NamedTemporaryFile(prefix=EXPORT_PREFIXE, suffix=".csv", delete=False, mode="w",
+                                          encoding="utf-8-sig", newline="")
+    with fichier:
+        if df.empty:
+            df.to_csv(fichier, index=False)
+        for debut in range(0, len(df), EXPORT_BLOC):
+            df.iloc[debut:debut + EXPORT_BLOC].to_csv(fichier, index=False, header=debut == 0)
+    return fichier.name
+
+def charger_rollups(periode=None):
+    """Agrégats de la copie locale, ou de la période filtrée"""
+    if periode is not None:
+        return rollups_periode(*periode)
+    store = get_table_store()
+    with store["lock"]:
+        rollups = {table: store["tables"][table]["rollup"] for table in TABLES}
+    return {
+        table: rollup if rollup is not None else construire_rollup(table, pd.DataFrame())
+        for table, rollup in rollups.items()
+    }
+
+def invalider_donnees():
+    """Bouton Actualiser : réveille le thread de synchronisation sans bloquer la page"""
+    get_rafraichisseur()["reveil"].set()
+    invalider_periodes()
+
+PERIODE_TTL = 60  # Secondes avant de retélécharger une plage de dates
+PERIODE_ENTREES = 20  # Plages gardées en mémoire (les moins récemment lues sont évincées)
+
+@st.cache_resource
+def get_cache_periodes():
+    """Plages de dates téléchargées, partagées par le processus (sans copie ni sérialisation)"""
+    return {"lock": threading.Lock(), "entrees": OrderedDict()}
+
+def telecharger_periode(date_debut, date_fin):
+    """Tables filtrées côté serveur sur created_at (bornes incluses) ; (tables, complet)"""
+    filtre = [f"gte.{date_debut.isoformat()}", f"lt.{(date_fin + timedelta(days=1)).isoformat()}"]
+    dfs = {}
+    complet = True
+    
+    try:
+        resultats = telecharger_tables({
+            table: {"select": ",".join(COLONNES[table]), "created_at": filtre}
+            for table in TABLES
+        })
+        for table, (df, erreur) in resultats.items():
+            if erreur is not None:
+                st.error(erreur)
+                df = pd.DataFrame(columns=COLONNES[table])
+                complet = False
+            dfs[table] = df
+    
     except Exception as e:
         st.error(f"Erreur lors du chargement des données: {str(e)}")
-        # Retourner des DataFrames vides pour toutes les tables en cas d'erreur
-        return {TABLE_RENDEMENT: pd.DataFrame(), 
-                TABLE_PANNES: pd.DataFrame(), 
-                TABLE_ERREURS: pd.DataFrame()}
+        return {table: pd.DataFrame() for table in TABLES}, False
     
-    return dfs
+    return dfs, complet
 
-def calculer_kpis(df_rendement, df_pannes, df_erreurs):
-    kpis = {
-        "rendement_ligne1": 0,
-        "rendement_ligne2": 0,
-        "non_productivite": 0,
-        "sous_performance": 0,
-        "variabilite": 0,
-        "nb_pannes": 0,
-        "mtbf": 0,
-        "ratio_erreurs": 0,
-        "score_global": 0
+def entree_periode(date_debut, date_fin):
+    """Tables et agrégats d'une plage, téléchargés au plus toutes les PERIODE_TTL secondes"""
+    cache = get_cache_periodes()
+    cle = (date_debut, date_fin)
+    with cache["lock"]:
+        entree = cache["entrees"].get(cle)
+        if entree is not None and entree["expire"] > time():
+            cache["entrees"].move_to_end(cle)
+            return entree
+    
+    dfs, complet = telecharger_periode(date_debut, date_fin)
+    entree = {
+        "expire": time() + PERIODE_TTL,
+        "dfs": dfs,
+        "rollups": {table: construire_rollup(table, dfs[table]) for table in TABLES}
     }
+    if complet:  # Une plage en erreur est retentée à la prochaine lecture
+        with cache["lock"]:
+            cache["entrees"][cle] = entree
+            while len(cache["entrees"]) > PERIODE_ENTREES:
+                cache["entrees"].popitem(last=False)
+    return entree
+
+def charger_donnees_periode(date_debut, date_fin):
+    """Tables de la plage : copies superficielles de l'entrée partagée (lecture peu coûteuse)"""
+    return {table: df.copy(deep=False) for table, df in entree_periode(date_debut, date_fin)["dfs"].items()}
+
+def rollups_periode(date_debut, date_fin):
+    """Agrégats des tables de la période, calculés une fois par téléchargement"""
+    return entree_periode(date_debut, date_fin)["rollups"]
+
+def invalider_periodes(jours=None):
+    """Retire du cache les plages contenant l'un des `jours` (toutes si None)"""
+    cache = get_cache_periodes()
+    with cache["lock"]:
+        if jours is None:
+            cache["entrees"].clear()
+            return
+        for debut, fin in list(cache["entrees"]):
+            if any(debut <= jour <= fin for jour in jours):
+                del cache["entrees"][(debut, fin)]
+
+@st.cache_data(ttl=300)
+def charger_textes(table, ids):
+    """Colonnes texte lourdes (COLONNES_TEXTE) pour une liste d'ids"""
+    colonnes = ["id"] + COLONNES_TEXTE[table]
+    if not ids:
+        return pd.DataFrame(columns=colonnes)
+    
+    response = supabase_get(table, {
+        "select": ",".join(colonnes),
+        "id": f"in.({','.join(str(i) for i in ids)})"
+    })
+    if response.status_code == 200:
+        return pd.DataFrame(response.json(), columns=colonnes)
+    return pd.DataFrame(columns=colonnes)
+
+def avec_textes(table, df):
+    """Complète les lignes affichées avec leurs colonnes texte"""
+    if df.empty or 'id' not in df.columns:
+        return df
+    ids = tuple(int(i) for i in df['id'].dropna())
+    textes = charger_textes(table, ids)
+    return df.merge(textes, on='id', how='left')
+
+@dataclass
+class ResultatKPI:
+    """Indicateurs calculés par calculer_kpis, indépendants de l'affichage"""
+    rendement_par_ligne: dict = field(default_factory=dict)  # {ligne: rendement moyen kg/h}
+    non_productivite: float = 0.0
+    sous_performance: float = 0.0
+    variabilite: float = 0.0
+    nb_pannes: int = 0
+    mtbf: float = 0.0
+    ratio_erreurs: float = 0.0
+    score_global: float = 0.0
+    
+    def lignes(self):
+        """Lignes à afficher : lignes par défaut et toute ligne présente dans les données"""
+        return sorted(set(LIGNES) | set(self.rendement_par_ligne))
+
+def calculer_kpis(df_rendement, df_pannes, df_erreurs, seuils):
+    """Calcule tous les indicateurs en une passe numpy par table, quel que soit le nombre de lignes"""
+    kpis = ResultatKPI()
     
     try:
         if not df_rendement.empty:
@@ -226,51 +1800,59 @@ def calculer_kpis(df_rendement, df_pannes, df_erreurs):
             if missing_columns:
                 st.warning(f"Colonnes manquantes dans df_rendement: {missing_columns}")
             else:
-                # Rendement par ligne
-                if 1 in df_rendement["ligne"].unique():
-                    kpis["rendement_ligne1"] = df_rendement[df_rendement["ligne"] == 1]["rendement"].mean()
+                rendement = df_rendement["rendement"].to_numpy(dtype=float)
+                valide = ~np.isnan(rendement)
                 
-                if 2 in df_rendement["ligne"].unique():
-                    kpis["rendement_ligne2"] = df_rendement[df_rendement["ligne"] == 2]["rendement"].mean()
+                # Rendement moyen par ligne (sommes et effectifs groupés)
+                codes_ligne, lignes = pd.factorize(df_rendement["ligne"], sort=True)
+                masque = valide & (codes_ligne >= 0)
+                sommes = np.bincount(codes_ligne[masque], weights=rendement[masque], minlength=len(lignes))
+                effectifs = np.bincount(codes_ligne[masque], minlength=len(lignes))
+                kpis.rendement_par_ligne = {
+                    (ligne.item() if hasattr(ligne, "item") else ligne): sommes[i] / effectifs[i]
+                    for i, ligne in enumerate(lignes) if effectifs[i] > 0
+                }
                 
-                # Non-productivité
+                # Non-productivité (niveaux Critique et Faible)
                 total_pesees = len(df_rendement)
-                if 'niveau_rendement' in df_rendement.columns:
-                    non_productives = len(df_rendement[df_rendement["niveau_rendement"].isin(["Faible", "Critique"])])
-                    kpis["non_productivite"] = (non_productives / total_pesees) * 100 if total_pesees > 0 else 0
+                non_productives = np.count_nonzero((rendement > 0) & (rendement <= seuils["rendement"]["moyen"]))
+                kpis.non_productivite = (non_productives / total_pesees) * 100
                 
-                # Sous-performance
-                seuil_sous_perf = st.session_state.seuils["rendement"]["moyen"]
-                sous_perf = df_rendement[df_rendement["rendement"] < seuil_sous_perf]["operatrice_id"].nunique()
-                total_operatrices = df_rendement["operatrice_id"].nunique()
-                kpis["sous_performance"] = (sous_perf / total_operatrices) * 100 if total_operatrices > 0 else 0
+                # Sous-performance : opératrices ayant au moins une pesée sous le seuil moyen
+                codes_op, operatrices = pd.factorize(df_rendement["operatrice_id"])
+                sous_seuil = valide & (codes_op >= 0) & (rendement < seuils["rendement"]["moyen"])
+                sous_perf = np.count_nonzero(np.bincount(codes_op[sous_seuil], minlength=len(operatrices)))
+                kpis.sous_performance = (sous_perf / len(operatrices)) * 100 if len(operatrices) > 0 else 0
                 
-                # Variabilité
-                kpis["variabilite"] = df_rendement["rendement"].std()
+                # Variabilité (écart-type échantillon à partir des sommes)
+                n = np.count_nonzero(valide)
+                if n > 1:
+                    somme = rendement[valide].sum()
+                    somme_carres = np.square(rendement[valide]).sum()
+                    variance = (somme_carres - somme * somme / n) / (n - 1)
+                    kpis.variabilite = float(np.sqrt(max(variance, 0.0)))
         
         if not df_pannes.empty:
             # Pannes
-            kpis["nb_pannes"] = len(df_pannes)
+            kpis.nb_pannes = len(df_pannes)
             
-            # MTBF
-            if len(df_pannes) > 1 and 'date_heure' in df_pannes.columns:
-                try:
-                    deltas = df_pannes["date_heure"].sort_values().diff().dt.total_seconds() / 60
-                    kpis["mtbf"] = deltas.mean()
-                except:
-                    kpis["mtbf"] = 0
+            # MTBF : moyenne des écarts entre pannes triées = (dernière - première) / (n - 1)
+            if 'date_heure' in df_pannes.columns:
+                dates = df_pannes["date_heure"].dropna()
+                if len(dates) > 1:
+                    kpis.mtbf = (dates.max() - dates.min()).total_seconds() / 60 / (len(dates) - 1)
         
         if not df_erreurs.empty:
             # Erreurs
-            kpis["ratio_erreurs"] = (len(df_erreurs) / len(df_rendement)) * 100 if not df_rendement.empty else 0
+            kpis.ratio_erreurs = (len(df_erreurs) / len(df_rendement)) * 100 if not df_rendement.empty else 0
         
         # Score global
-        kpis["score_global"] = min(100, max(0, 100 - (
-            max(0, kpis.get("non_productivite", 0) - st.session_state.seuils["non_productivite"]) + 
-            max(0, kpis.get("sous_performance", 0) - st.session_state.seuils["sous_performance"]) +
-            max(0, kpis.get("variabilite", 0) - st.session_state.seuils["variabilite"]) * 2 +
-            max(0, kpis.get("nb_pannes", 0) - st.session_state.seuils["pannes"]) * 5 +
-            max(0, kpis.get("ratio_erreurs", 0) - st.session_state.seuils["erreurs"])
+        kpis.score_global = min(100, max(0, 100 - (
+            max(0, kpis.non_productivite - seuils["non_productivite"]) + 
+            max(0, kpis.sous_performance - seuils["sous_performance"]) +
+            max(0, kpis.variabilite - seuils["variabilite"]) * 2 +
+            max(0, kpis.nb_pannes - seuils["pannes"]) * 5 +
+            max(0, kpis.ratio_erreurs - seuils["erreurs"])
         )))
     
     except Exception as e:
@@ -278,6 +1860,187 @@ def calculer_kpis(df_rendement, df_pannes, df_erreurs):
     
     return kpis
 
+def check_alertes(kpis, seuils):
+    alertes = []
+    
+    try:
+        for ligne in kpis.lignes():
+            rendement_ligne = kpis.rendement_par_ligne.get(ligne, 0)
+            if rendement_ligne < seuils["rendement"]["moyen"]:
+                alertes.append({
+                    "type": "Rendement",
+                    "message": f"Rendement ligne {ligne} faible: {rendement_ligne:.1f} kg/h",
+                    "gravite": "high",
+                    "icon": "📉"
+                })
+        
+        if kpis.non_productivite > seuils["non_productivite"]:
+            alertes.append({
+                "type": "Productivité",
+                "message": f"Taux de non-productivité élevé: {kpis.non_productivite:.1f}%",
+                "gravite": "medium",
+                "icon": "⏱️"
+            })
+        
+        if kpis.sous_performance > seuils["sous_performance"]:
+            alertes.append({
+                "type": "Performance",
+                "message": f"% opératrices sous-performantes: {kpis.sous_performance:.1f}%",
+                "gravite": "medium",
+                "icon": "👎"
+            })
+        
+        if kpis.variabilite > seuils["variabilite"]:
+            alertes.append({
+                "type": "Consistance",
+                "message": f"Variabilité du rendement élevée: {kpis.variabilite:.1f} kg/h",
+                "gravite": "medium",
+                "icon": "📊"
+            })
+        
+        if kpis.nb_pannes >= seuils["pannes"]:
+            alertes.append({
+                "type": "Pannes",
+                "message": f"Nombre de pannes signalées: {kpis.nb_pannes}",
+                "gravite": "high",
+                "icon": "🔧"
+            })
+        
+        if kpis.ratio_erreurs > seuils["erreurs"]:
+            alertes.append({
+                "type": "Erreurs",
+                "message": f"Ratio erreurs élevé: {kpis.ratio_erreurs:.1f}%",
+                "gravite": "high",
+                "icon": "❌"
+            })
+    except Exception as e:
+        st.error(f"Erreur lors de la vérification des alertes: {str(e)}")
+    
+    return alertes
+
+# --------------------------
+# 🎚️ SEUILS
+# --------------------------
+# Seuils partagés par toutes les sessions, enregistrés avec un numéro de version.
+# Les modifier ne touche pas aux données chargées : KPIs, alertes et niveaux sont
+# recalculés localement depuis la copie en mémoire.
+SEUILS_FICHIER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "seuils.json")
+SEUILS_HISTORIQUE = 20  # Versions précédentes conservées dans le fichier
+
+def fusionner_seuils(defaut, lus):
+    """Seuils lus complétés par les valeurs par défaut (clés ajoutées depuis)"""
+    seuils = json.loads(json.dumps(defaut))
+    for cle, valeur in lus.items():
+        if isinstance(valeur, dict) and isinstance(seuils.get(cle), dict):
+            seuils[cle].update(valeur)
+        elif cle in seuils:
+            seuils[cle] = valeur
+    return seuils
+
+@st.cache_resource
+def get_seuils_partages():
+    """Seuils en vigueur pour le processus, rechargés si le fichier change (autre processus)"""
+    return {"lock": threading.Lock(), "mtime": None, "contenu": {"version": 0, "seuils": SEUILS_DEFAUT}}
+
+def seuils_courants():
+    """Contenu du fichier des seuils : version, seuils, auteur et date de la modification"""
+    partage = get_seuils_partages()
+    with partage["lock"]:
+        mtime = os.path.getmtime(SEUILS_FICHIER) if os.path.exists(SEUILS_FICHIER) else None
+        if mtime is not None and mtime != partage["mtime"]:
+            try:
+                with open(SEUILS_FICHIER, encoding="utf-8") as f:
+                    contenu = json.load(f)
+                contenu["seuils"] = fusionner_seuils(SEUILS_DEFAUT, contenu.get("seuils", {}))
+                partage["contenu"] = contenu
+            except (OSError, ValueError):
+                pass  # Fichier illisible : on garde les derniers seuils connus
+            partage["mtime"] = mtime
+        return partage["contenu"]
+
+def enregistrer_seuils(seuils, auteur):
+    """Enregistre une nouvelle version des seuils (écriture atomique)"""
+    partage = get_seuils_partages()
+    with partage["lock"]:
+        precedent = partage["contenu"]
+        contenu = {
+            "version": precedent.get("version", 0) + 1,
+            "seuils": seuils,
+            "modifie_par": auteur,
+            "modifie_le": datetime.now().isoformat(timespec="seconds"),
+            "historique": ([{k: v for k, v in precedent.items() if k != "historique"}]
+                           + precedent.get("historique", []))[:SEUILS_HISTORIQUE]
+        }
+        
+        def ecrire(chemin):
+            with open(chemin, "w", encoding="utf-8") as f:
+                json.dump(contenu, f, ensure_ascii=False, indent=2)
+        ecrire_atomique(SEUILS_FICHIER, ecrire)
+        partage["contenu"] = contenu
+        partage["mtime"] = os.path.getmtime(SEUILS_FICHIER)
+    return contenu["version"]
+
+def synchroniser_seuils_session():
+    """Copie de session des seuils, remplacée quand une nouvelle version est enregistrée"""
+    contenu = seuils_courants()
+    if st.session_state.get("seuils_version") != contenu["version"]:
+        st.session_state.seuils = json.loads(json.dumps(contenu["seuils"]))
+        st.session_state.seuils_version = contenu["version"]
+
+def classer_rendements(rendement, seuils):
+    """Niveau de chaque rendement (vectorisé), bornes tirées des seuils"""
+    bornes = [0, seuils["rendement"]["critique"], seuils["rendement"]["moyen"],
+              seuils["rendement"]["haut"], float('inf')]
+    return pd.cut(rendement, bins=bornes, labels=LABELS_NIVEAU).astype(DTYPE_NIVEAU)
+
+def avec_niveau(df, seuils):
+    """Ajoute niveau_rendement aux lignes affichées ou exportées (la copie partagée n'est pas modifiée)"""
+    if df.empty or 'rendement' not in df.columns:
+        return df
+    return df.assign(niveau_rendement=classer_rendements(df["rendement"], seuils))
+
+KPI_CACHE_TAILLE = 64  # Nombre de combinaisons (données, seuils) mémorisées
+
+@st.cache_resource
+def get_cache_kpis():
+    """Cache LRU des KPIs et alertes, partagé par toutes les sessions"""
+    return {"lock": threading.Lock(), "entrees": OrderedDict()}
+
+def version_table(df):
+    """Jeton de version peu coûteux : nombre de lignes et bornes de id / created_at"""
+    version = [len(df)]
+    if not df.empty:
+        for col in ("id", "created_at"):
+            if col in df.columns:
+                version += [str(df[col].min()), str(df[col].max())]
+    return tuple(version)
+
+def kpis_et_alertes(df_rendement, df_pannes, df_erreurs, seuils):
+    """KPIs et alertes mémorisés par version des données et seuils.
+    
+    Un rerun qui ne change que l'interface retrouve le résultat sans recalcul.
+    """
+    cle = (
+        version_table(df_rendement),
+        version_table(df_pannes),
+        version_table(df_erreurs),
+        json.dumps(seuils, sort_keys=True)
+    )
+    cache = get_cache_kpis()
+    with cache["lock"]:
+        if cle in cache["entrees"]:
+            cache["entrees"].move_to_end(cle)
+            return cache["entrees"][cle]
+    
+    kpis = calculer_kpis(df_rendement, df_pannes, df_erreurs, seuils)
+    resultat = (kpis, check_alertes(kpis, seuils))
+    
+    with cache["lock"]:
+        cache["entrees"][cle] = resultat
+        while len(cache["entrees"]) > KPI_CACHE_TAILLE:
+            cache["entrees"].popitem(last=False)
+    return resultat
+
 def metric_card(title, value, delta=None, icon="📊", color=COLORS["primary"]):
     """Composant de carte métrique moderne avec couleur personnalisée"""
     st.markdown(f"""
@@ -291,6 +2054,20 @@ def metric_card(title, value, delta=None, icon="📊", color=COLORS["primary"]):
     </div>
     """, unsafe_allow_html=True)
 
+def carte_kpi(titre, valeur, legende, color, progression=None):
+    """Carte d'indicateur du tableau de bord ; progression = (valeur, maximum) pour la jauge"""
+    jauge = ""
+    if progression is not None:
+        jauge = f'<progress value="{progression[0]}" max="{progression[1]}" style="width: 100%; height: 6px;"></progress>'
+    st.markdown(f"""
+    <div style="background: white; border-radius: 10px; padding: 15px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); border-left: 4px solid {color}">
+        <div style="font-size: 14px; color: #555; margin-bottom: 5px;">{titre}</div>
+        <div style="font-size: 24px; font-weight: bold; color: {color}">{valeur}</div>
+        <div style="font-size: 12px; color: #777;">{legende}</div>
+        {jauge}
+    </div>
+    """, unsafe_allow_html=True)
+
 # --------------------------
 # 🔐 PAGE DE CONNEXION
 # --------------------------
@@ -319,104 +2096,102 @@ if not st.session_state.authenticated:
 # 📊 CHARGEMENT DES DONNÉES
 # --------------------------
 if st.button("🔄 Actualiser les données"):
-    st.cache_data.clear()
+    invalider_donnees()
 
-try:
-    data = charger_donnees()
-    df_rendement = data.get(TABLE_RENDEMENT, pd.DataFrame())
-    df_pannes = data.get(TABLE_PANNES, pd.DataFrame())
-    df_erreurs = data.get(TABLE_ERREURS, pd.DataFrame())
-
-    kpis = calculer_kpis(df_rendement, df_pannes, df_erreurs)
-except Exception as e:
-    st.error(f"Erreur critique lors du chargement des données: {str(e)}")
-    st.stop()
-
-# --------------------------
-# 🎨 EN-TÊTE PRINCIPAL
-# --------------------------
-st.markdown(f"""
-<div class="header">
-    <div style="display: flex; justify-content: space-between; align-items: center;">
-        <div>
-            <h1 style="margin: 0;">Suivi de Rendement VACPA</h1>
-            <p style="margin: 0; opacity: 0.8;">Connecté en tant que {st.session_state.username} ({st.session_state.role})</p>
-        </div>
-        <div style="text-align: right;">
-            <div style="font-size: 24px;">{datetime.now().strftime("%d %B %Y")}</div>
-            <div>Score global: <strong>{kpis.get('score_global', 0):.0f}/100</strong></div>
-        </div>
-    </div>
-</div>
-""", unsafe_allow_html=True)
+# Seuils en vigueur (nouvelle version enregistrée par un autre utilisateur : reprise ici)
+synchroniser_seuils_session()
 
 # --------------------------
-# 🔔 SECTION ALERTES AMÉLIORÉE
+# 📅 Filtres (uniquement pour admin/manager)
 # --------------------------
-def check_alertes(kpis):
-    alertes = []
-    
-    try:
-        if kpis.get("rendement_ligne1", 0) < st.session_state.seuils["rendement"]["moyen"]:
-            alertes.append({
-                "type": "Rendement",
-                "message": f"Rendement ligne 1 faible: {kpis['rendement_ligne1']:.1f} kg/h",
-                "gravite": "high",
-                "icon": "📉"
-            })
-        
-        if kpis.get("rendement_ligne2", 0) < st.session_state.seuils["rendement"]["moyen"]:
-            alertes.append({
-                "type": "Rendement", 
-                "message": f"Rendement ligne 2 faible: {kpis['rendement_ligne2']:.1f} kg/h",
-                "gravite": "high",
-                "icon": "📉"
-            })
-        
-        if kpis.get("non_productivite", 0) > st.session_state.seuils["non_productivite"]:
-            alertes.append({
-                "type": "Productivité",
-                "message": f"Taux de non-productivité élevé: {kpis['non_productivite']:.1f}%",
-                "gravite": "medium",
-                "icon": "⏱️"
-            })
-        
-        if kpis.get("sous_performance", 0) > st.session_state.seuils["sous_performance"]:
-            alertes.append({
-                "type": "Performance",
-                "message": f"% opératrices sous-performantes: {kpis['sous_performance']:.1f}%",
-                "gravite": "medium",
-                "icon": "👎"
-            })
-        
-        if kpis.get("variabilite", 0) > st.session_state.seuils["variabilite"]:
-            alertes.append({
-                "type": "Consistance",
-                "message": f"Variabilité du rendement élevée: {kpis['variabilite']:.1f} kg/h",
-                "gravite": "medium",
-                "icon": "📊"
-            })
-        
-        if kpis.get("nb_pannes", 0) >= st.session_state.seuils["pannes"]:
-            alertes.append({
-                "type": "Pannes",
-                "message": f"Nombre de pannes signalées: {kpis['nb_pannes']}",
-                "gravite": "high",
-                "icon": "🔧"
-            })
-        
-        if kpis.get("ratio_erreurs", 0) > st.session_state.seuils["erreurs"]:
-            alertes.append({
-                "type": "Erreurs",
-                "message": f"Ratio erreurs élevé: {kpis['ratio_erreurs']:.1f}%",
-                "gravite": "high",
-                "icon": "❌"
-            })
-    except Exception as e:
-        st.error(f"Erreur lors de la vérification des alertes: {str(e)}")
-    
-    return alertes
+# La plage choisie est envoyée à PostgREST : seules les lignes de la période sont
+# téléchargées, et KPIs comme graphiques sont calculés sur ces données réduites
+periode = None
+if st.session_state.role in ["admin", "manager"]:
+    with st.expander("🔍 Filtres"):
+        filtre_actif = st.checkbox("Limiter à une plage de dates", key="filtre_dates_actif")
+        aujourd_hui = datetime.today().date()
+        plage = st.date_input(
+            "Plage de dates",
+            [aujourd_hui - timedelta(days=7), aujourd_hui],
+            disabled=not filtre_actif
+        )
+        if filtre_actif and len(plage) == 2:
+            periode = (plage[0], plage[1])
+
+# Thread d'envoi de la file d'attente (démarré une fois par processus)
+get_flusher()
+
+# Chargement complet une fois par exécution de la page : les erreurs arrêtent la page ici,
+# et les fragments retrouvent ensuite tables, agrégats et KPIs en cache
+try:
+    data = charger_donnees() if periode is None else charger_donnees_periode(*periode)
+    df_rendement = data.get(TABLE_RENDEMENT, pd.DataFrame())
+    df_pannes = data.get(TABLE_PANNES, pd.DataFrame())
+    df_erreurs = data.get(TABLE_ERREURS, pd.DataFrame())
+
+    charger_rollups(periode)
+    kpis_et_alertes(df_rendement, df_pannes, df_erreurs, st.session_state.seuils)
+except Exception as e:
+    st.error(f"Erreur critique lors du chargement des données: {str(e)}")
+    st.stop()
+
+if periode is None:
+    afficher_etat_synchro()
+
+# --------------------------
+# 🧱 FRAGMENTS
+# --------------------------
+# La page est découpée en fragments (@st.fragment) : une saisie dans un formulaire ou un
+# panneau ne réexécute que ce fragment, pas le chargement, les KPIs ni les graphiques.
+# Chaque fragment reçoit la période en paramètre et relit ses données ci-dessous :
+# copies superficielles de la copie partagée ou de la plage en cache (get_cache_periodes),
+# agrégats et KPIs en cache — ni appel réseau ni désérialisation.
+# En mode direct, en-tête, cartes et alertes se réexécutent seules toutes les DIRECT_INTERVALLE s ;
+# sur la vue par période (figée), pas de rafraîchissement automatique.
+intervalle_direct = DIRECT_INTERVALLE if st.session_state.get("mode_direct") and periode is None else None
+
+def donnees_courantes(periode):
+    """Tables de la vue courante : copie partagée ou plage de dates"""
+    return charger_donnees() if periode is None else charger_donnees_periode(*periode)
+
+def kpis_courants(periode):
+    """KPIs et alertes de la vue courante (relus à chaque exécution d'un fragment)"""
+    data = donnees_courantes(periode)
+    return kpis_et_alertes(
+        data.get(TABLE_RENDEMENT, pd.DataFrame()),
+        data.get(TABLE_PANNES, pd.DataFrame()),
+        data.get(TABLE_ERREURS, pd.DataFrame()),
+        st.session_state.seuils
+    )
+
+# --------------------------
+# 🎨 EN-TÊTE PRINCIPAL
+# --------------------------
+@st.fragment(run_every=intervalle_direct)
+def section_entete(periode):
+    """Bandeau principal avec le score global"""
+    kpis, _ = kpis_courants(periode)
+    st.markdown(f"""
+<div class="header">
+    <div style="display: flex; justify-content: space-between; align-items: center;">
+        <div>
+            <h1 style="margin: 0;">Suivi de Rendement VACPA</h1>
+            <p style="margin: 0; opacity: 0.8;">Connecté en tant que {st.session_state.username} ({st.session_state.role})</p>
+        </div>
+        <div style="text-align: right;">
+            <div style="font-size: 24px;">{datetime.now().strftime("%d %B %Y")}</div>
+            <div>Score global: <strong>{kpis.score_global:.0f}/100</strong></div>
+        </div>
+    </div>
+</div>
+""", unsafe_allow_html=True)
+
+section_entete(periode)
 
+# --------------------------
+# 🔔 SECTION ALERTES AMÉLIORÉE
+# --------------------------
 def display_alertes(alertes):
     if not alertes:
         st.success("✅ Aucune alerte en cours - Toutes les métriques sont dans les normes")
@@ -479,9 +2254,14 @@ with st.sidebar:
     st.divider()
     
     if st.button("🔄 Actualiser les données", key="refresh_sidebar"):
-        st.cache_data.clear()
+        invalider_donnees()
         st.rerun()
     
+    mode_direct = st.toggle("🔴 Mode direct", key="mode_direct",
+                            help="Cartes et alertes mises à jour dès qu'une pesée ou un signalement est enregistré")
+    if mode_direct:
+        afficher_etat_flux(get_flux_direct())
+    
     if st.button("🚪 Déconnexion", type="primary"):
         st.session_state.authenticated = False
         st.session_state.username = None
@@ -491,267 +2271,294 @@ with st.sidebar:
 # --------------------------
 # Afficher les alertes après la sidebar et avant le contenu principal
 # --------------------------
-nouvelles_alertes = check_alertes(kpis)
-
 # Mise à jour des alertes en session
 if not hasattr(st.session_state, 'alertes'):
     st.session_state.alertes = []
 
-# Ajouter seulement les nouvelles alertes qui n'existent pas déjà
-for alerte in nouvelles_alertes:
-    if alerte['message'] not in [a['message'] for a in st.session_state.alertes]:
-        st.session_state.alertes.append(alerte)
+@st.fragment(run_every=intervalle_direct)
+def section_alertes(periode):
+    """Alertes en session, complétées à chaque rafraîchissement en mode direct"""
+    _, nouvelles_alertes = kpis_courants(periode)
+    
+    # Ajouter seulement les nouvelles alertes qui n'existent pas déjà
+    for alerte in nouvelles_alertes:
+        if alerte['message'] not in [a['message'] for a in st.session_state.alertes]:
+            st.session_state.alertes.append(alerte)
+    
+    # Afficher les alertes
+    display_alertes(st.session_state.alertes)
 
-# Afficher les alertes
-display_alertes(st.session_state.alertes)
+section_alertes(periode)
 
 # --------------------------
 # 👷 INTERFACE OPERATEUR
 # --------------------------
+# Chaque bloc interactif est un fragment : un clic ou une saisie ne réexécute que son bloc.
+# Les données sont relues via donnees_courantes / charger_rollups (copies peu coûteuses).
+@st.fragment(run_every=intervalle_direct)
+def section_stats_operatrice(periode):
+    """Statistiques personnelles et progression de l'opératrice connectée"""
+    df_rendement = donnees_courantes(periode).get(TABLE_RENDEMENT, pd.DataFrame())
+    
+    # Statistiques personnelles
+    st.markdown(f"### 📈 Bonjour {st.session_state.username}")
+    
+    if not df_rendement.empty:
+        df_operateur = lignes_operatrice(TABLE_RENDEMENT, st.session_state.username)
+        
+        if not df_operateur.empty:
+            # Cartes métriques en grille
+            cols = st.columns(3)
+            with cols[0]:
+                metric_card("Votre rendement", f"{df_operateur['rendement'].mean():.1f} kg/h", 
+                           icon="⚡", color=COLORS["primary"])
+            with cols[1]:
+                metric_card("Total produit", f"{df_operateur['poids_kg'].sum():.1f} kg", 
+                           icon="📦", color=COLORS["secondary"])
+            with cols[2]:
+                metric_card("Pesées", f"{len(df_operateur)}", 
+                           icon="✍️", color=COLORS["success"])
+            
+            # Graphique de performance
+            st.markdown("#### Votre progression")
+            if 'date' in df_operateur.columns:
+                fig = px.line(
+                    df_operateur.iloc[::-1],  # Partition triée du plus récent au plus ancien
+                    x='date',
+                    y='rendement',
+                    height=300,
+                    template="plotly_white"
+                )
+                fig.update_layout(
+                    margin=dict(l=0, r=0, t=0, b=0),
+                    xaxis_title="Date",
+                    yaxis_title="Rendement (kg/h)"
+                )
+                st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("Vous n'avez pas encore enregistré de pesée aujourd'hui.")
+
+@st.fragment
+def formulaire_pesee_operatrice():
+    """Saisie d'une pesée, mise en file d'attente"""
+    with st.form("operateur_pesee_form", clear_on_submit=True):
+        # Liste des opérateurs depuis l'annuaire partagé
+        operateurs = annuaire_operatrices() or OPERATRICES_DEFAUT
+        
+        # Sélection de l'opérateur
+        operatrice_id = st.selectbox(
+            "Opérateur",
+            options=operateurs,
+            index=operateurs.index(st.session_state.username) if st.session_state.username in operateurs else 0
+        )
+        
+        ligne = st.selectbox("Ligne", [1, 2])
+        poids_kg = st.number_input("Poids (kg)", min_value=0.1, value=1.0, step=0.1)
+        # Numéro pré-rempli avec le prochain numéro libre du jour
+        numero_pesee = st.number_input(
+            "N° Pesée",
+            min_value=1,
+            value=prochain_numero_pesee(operatrice_id, datetime.now().date())
+        )
+        heure_travail = st.number_input("Heures travaillées", min_value=0.1, value=5.0, step=0.1)
+        commentaire = st.text_input("Commentaire (optionnel)")
+        
+        submitted = st.form_submit_button("💾 Enregistrer la pesée")
+        
+        if submitted:
+            aujourd_hui = datetime.now().date()
+            # Doublon déjà connu localement (copie synchronisée ou file d'attente)
+            if pesee_existe(operatrice_id, aujourd_hui, numero_pesee) or pesee_en_attente(operatrice_id, aujourd_hui, numero_pesee):
+                st.error(MESSAGE_PESEE_EXISTANTE)
+            else:
+                data = {
+                    "operatrice_id": operatrice_id,
+                    "poids_kg": poids_kg,
+                    "ligne": ligne,
+                    "numero_pesee": numero_pesee,
+                    "date": aujourd_hui.isoformat(),
+                    "heure_travail": heure_travail,
+                    "commentaire_pesee": commentaire,
+                    "created_at": datetime.now().isoformat() + "Z",
+                    "type_produit": "marcadona"
+                }
+                
+                try:
+                    # Journalisée localement, envoyée en arrière-plan
+                    mettre_en_attente(TABLE_RENDEMENT, data, st.session_state.username)
+                    st.success("Pesée enregistrée, synchronisation en cours")
+                    st.rerun()
+                except sqlite3.Error as e:
+                    st.error(f"Erreur d'enregistrement local: {str(e)}")
+
+@st.fragment
+def formulaire_signalement_operatrice():
+    """Signalement d'une panne ou d'une erreur par l'opératrice"""
+    with st.form("operateur_probleme_form"):
+        type_probleme = st.selectbox("Type de problème", ["Panne", "Erreur", "Problème qualité", "Autre"])
+        ligne = st.selectbox("Ligne concernée", [1, 2])
+        gravite = st.select_slider("Gravité", options=GRAVITES)
+        description = st.text_area("Description détaillée")
+        
+        submitted = st.form_submit_button("⚠️ Envoyer le signalement")
+        
+        if submitted:
+            table = TABLE_PANNES if type_probleme == "Panne" else TABLE_ERREURS
+            data = {
+                "ligne": ligne,
+                "type_erreur": type_probleme,
+                "gravite": gravite,
+                "description": description,
+                "operatrice_id": st.session_state.username,
+                "date_heure": datetime.now().isoformat() + "Z",
+                "created_at": datetime.now().isoformat() + "Z"
+            }
+            
+            try:
+                mettre_en_attente(table, data, st.session_state.username)
+                st.success("Signalement envoyé au responsable!")
+                st.rerun()
+            except sqlite3.Error as e:
+                st.error(f"Erreur: {str(e)}")
+
+@st.fragment
+def onglet_historique_operatrice(periode):
+    """Dernières pesées et derniers signalements de l'opératrice"""
+    data = donnees_courantes(periode)
+    df_rendement = data.get(TABLE_RENDEMENT, pd.DataFrame())
+    df_pannes = data.get(TABLE_PANNES, pd.DataFrame())
+    df_erreurs = data.get(TABLE_ERREURS, pd.DataFrame())
+    
+    st.markdown("#### Votre activité récente")
+    if not df_rendement.empty:
+        df_mes_pesees = lignes_operatrice(TABLE_RENDEMENT, st.session_state.username)
+        if not df_mes_pesees.empty:
+            st.dataframe(
+                avec_niveau(avec_textes(TABLE_RENDEMENT, df_mes_pesees.head(20)), st.session_state.seuils),
+                column_config={
+                    "date": "Date",
+                    "ligne": "Ligne",
+                    "poids_kg": st.column_config.NumberColumn("Poids (kg)", format="%.1f kg"),
+                    "numero_pesee": "N° Pesée",
+                    "rendement": st.column_config.NumberColumn("Rendement (kg/h)", format="%.1f"),
+                    "niveau_rendement": "Niveau",
+                    "commentaire_pesee": "Commentaire"
+                },
+                hide_index=True,
+                use_container_width=True
+            )
+        else:
+            st.info("Aucune pesée enregistrée")
+    
+    st.markdown("#### Vos signalements")
+    if not df_pannes.empty or not df_erreurs.empty:
+        df_mes_pannes = lignes_operatrice(TABLE_PANNES, st.session_state.username)
+        df_mes_erreurs = lignes_operatrice(TABLE_ERREURS, st.session_state.username)
+        
+        if not df_mes_pannes.empty or not df_mes_erreurs.empty:
+            # Partitions déjà triées : les 10 plus récents de chaque table suffisent
+            df_signals = pd.concat([
+                avec_textes(TABLE_PANNES, df_mes_pannes.head(10)).assign(type="Panne"),
+                avec_textes(TABLE_ERREURS, df_mes_erreurs.head(10)).assign(type="Erreur")
+            ])
+            
+            st.dataframe(
+                df_signals.sort_values('date_heure', ascending=False).head(10),
+                column_config={
+                    "date_heure": "Date/Heure",
+                    "type_erreur": "Type",
+                    "ligne": "Ligne",
+                    "description": "Description",
+                    "gravite": "Gravité"
+                },
+                hide_index=True,
+                use_container_width=True
+            )
+        else:
+            st.info("Aucun signalement enregistré")
+
+@st.fragment
+def onglet_classement(periode):
+    """Top 10 des opératrices, depuis l'agrégat des rendements"""
+    df_rendement = donnees_courantes(periode).get(TABLE_RENDEMENT, pd.DataFrame())
+    rollups = charger_rollups(periode)
+    
+    st.markdown("#### 🏆 Top 10 des opératrices (affichage visuel simple)")
+
+    if not df_rendement.empty and 'operatrice_id' in df_rendement.columns:
+      import plotly.graph_objects as go
+
+      # Rendement moyen par opératrice (depuis l'agrégat)
+      perf_operatrices = perf_par_groupe(rollups[TABLE_RENDEMENT], 'operatrice_id')
+      perf_operatrices = perf_operatrices.sort_values(by='rendement', ascending=False).reset_index(drop=True)
+      top10 = perf_operatrices.head(10)
+
+      # Couleurs personnalisées pour chaque opératrice
+      couleurs = [
+          "#FFD700", "#C0C0C0", "#CD7F32", "#FF69B4", "#FF8C00",
+          "#00CED1", "#ADFF2F", "#9370DB", "#00FA9A", "#4682B4"
+      ]
+
+      # Création du graphique
+      fig = go.Figure(go.Bar(
+          x=top10['operatrice_id'],
+          y=top10['rendement'],
+          marker=dict(color=couleurs[:len(top10)]),
+          text=top10['rendement'].round(1).astype(str) + " kg/h",
+          textposition='outside',
+          width=0.85
+      ))
+
+      fig.update_layout(
+          height=500,
+          plot_bgcolor='white',
+          margin=dict(l=20, r=20, t=40, b=60),
+          showlegend=False,
+          xaxis=dict(
+              tickfont=dict(size=16, color='black'),
+              title='',
+              showline=False,
+              showticklabels=True,
+              showgrid=False,
+              zeroline=False
+          ),
+          yaxis=dict(
+              visible=False  # ❌ Masquer complètement l'axe des ordonnées
+          ),
+      )
+
+      st.plotly_chart(fig, use_container_width=True)
+    else:
+      st.warning("⚠️ Aucune donnée de rendement disponible pour le classement.")
+
 if st.session_state.role == "operateur":
     # Section principale en 2 colonnes
     col1, col2 = st.columns([2, 1])
     
     with col1:
-        # Statistiques personnelles
-        st.markdown(f"### 📈 Bonjour {st.session_state.username}")
-        
-        if not df_rendement.empty:
-            df_operateur = df_rendement[df_rendement['operatrice_id'] == st.session_state.username]
-            
-            if not df_operateur.empty:
-                # Cartes métriques en grille
-                cols = st.columns(3)
-                with cols[0]:
-                    metric_card("Votre rendement", f"{df_operateur['rendement'].mean():.1f} kg/h", 
-                               icon="⚡", color=COLORS["primary"])
-                with cols[1]:
-                    metric_card("Total produit", f"{df_operateur['poids_kg'].sum():.1f} kg", 
-                               icon="📦", color=COLORS["secondary"])
-                with cols[2]:
-                    metric_card("Pesées", f"{len(df_operateur)}", 
-                               icon="✍️", color=COLORS["success"])
-                
-                # Graphique de performance
-                st.markdown("#### Votre progression")
-                if 'date' in df_operateur.columns:
-                    fig = px.line(
-                        df_operateur.sort_values('date'),
-                        x='date',
-                        y='rendement',
-                        height=300,
-                        template="plotly_white"
-                    )
-                    fig.update_layout(
-                        margin=dict(l=0, r=0, t=0, b=0),
-                        xaxis_title="Date",
-                        yaxis_title="Rendement (kg/h)"
-                    )
-                    st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("Vous n'avez pas encore enregistré de pesée aujourd'hui.")
+        section_stats_operatrice(periode)
     
     with col2:
         # Actions rapides
         st.markdown("### 🚀 Actions rapides")
         with st.expander("➕ Nouvelle pesée", expanded=True):
-            with st.form("operateur_pesee_form", clear_on_submit=True):
-                # Charger la liste des opérateurs depuis la table des rendements
-                response = requests.get(
-                    f"{SUPABASE_URL}/rest/v1/{TABLE_RENDEMENT}?select=operatrice_id",
-                    headers=headers
-                )
-                
-                operateurs = ["operateur", "marwa"]  # Valeurs par défaut
-                if response.status_code == 200:
-                    operateurs = list(set([op['operatrice_id'] for op in response.json()]))
-                
-                # Sélection de l'opérateur
-                operatrice_id = st.selectbox(
-                    "Opérateur",
-                    options=operateurs,
-                    index=operateurs.index(st.session_state.username) if st.session_state.username in operateurs else 0
-                )
-                
-                ligne = st.selectbox("Ligne", [1, 2])
-                poids_kg = st.number_input("Poids (kg)", min_value=0.1, value=1.0, step=0.1)
-                numero_pesee = st.number_input("N° Pesée", min_value=1, value=1)
-                heure_travail = st.number_input("Heures travaillées", min_value=0.1, value=5.0, step=0.1)
-                commentaire = st.text_input("Commentaire (optionnel)")
-                
-                submitted = st.form_submit_button("💾 Enregistrer la pesée")
-                
-                if submitted:
-                    # Vérifier si une pesée avec ce numéro existe déjà pour aujourd'hui
-                    check_url = f"{SUPABASE_URL}/rest/v1/{TABLE_RENDEMENT}?select=id&operatrice_id=eq.{operatrice_id}&date=eq.{datetime.now().date().isoformat()}&numero_pesee=eq.{numero_pesee}"
-                    check_response = requests.get(check_url, headers=headers)
-                    
-                    if check_response.status_code == 200 and len(check_response.json()) > 0:
-                        st.error("Une pesée avec ce numéro existe déjà pour aujourd'hui. Veuillez utiliser un numéro différent.")
-                    else:
-                        data = {
-                            "operatrice_id": operatrice_id,
-                            "poids_kg": poids_kg,
-                            "ligne": ligne,
-                            "numero_pesee": numero_pesee,
-                            "date": datetime.now().date().isoformat(),
-                            "heure_travail": heure_travail,
-                            "commentaire_pesee": commentaire,
-                            "created_at": datetime.now().isoformat() + "Z",
-                            "type_produit": "marcadona"
-                        }
-                        
-                        try:
-                            response = requests.post(
-                                f"{SUPABASE_URL}/rest/v1/{TABLE_RENDEMENT}",
-                                headers=headers,
-                                json=data
-                            )
-                            
-                            if response.status_code == 201:
-                                st.success("Pesée enregistrée avec succès!")
-                                st.cache_data.clear()
-                                st.rerun()
-                            else:
-                                st.error(f"Erreur {response.status_code}: {response.text}")
-                        except Exception as e:
-                            st.error(f"Erreur de connexion: {str(e)}")
+            formulaire_pesee_operatrice()
 
         # Formulaire de signalement
         with st.expander("⚠️ Signaler un problème"):
-            with st.form("operateur_probleme_form"):
-                type_probleme = st.selectbox("Type de problème", ["Panne", "Erreur", "Problème qualité", "Autre"])
-                ligne = st.selectbox("Ligne concernée", [1, 2])
-                gravite = st.select_slider("Gravité", options=["Léger", "Modéré", "Grave", "Critique"])
-                description = st.text_area("Description détaillée")
-                
-                submitted = st.form_submit_button("⚠️ Envoyer le signalement")
-                
-                if submitted:
-                    table = TABLE_PANNES if type_probleme == "Panne" else TABLE_ERREURS
-                    data = {
-                        "ligne": ligne,
-                        "type_erreur": type_probleme,
-                        "gravite": gravite,
-                        "description": description,
-                        "operatrice_id": st.session_state.username,
-                        "date_heure": datetime.now().isoformat() + "Z",
-                        "created_at": datetime.now().isoformat() + "Z"
-                    }
-                    
-                    try:
-                        response = requests.post(
-                            f"{SUPABASE_URL}/rest/v1/{table}",
-                            headers=headers,
-                            json=data
-                        )
-                        if response.status_code == 201:
-                            st.success("Signalement envoyé au responsable!")
-                            st.cache_data.clear()
-                            st.rerun()
-                        else:
-                            st.error(f"Erreur {response.status_code}: {response.text}")
-                    except Exception as e:
-                        st.error(f"Erreur: {str(e)}")
+            formulaire_signalement_operatrice()
+        
+        # Statut de synchronisation des saisies
+        afficher_etat_file_attente(st.session_state.username)
     
     # Onglets secondaires
     tab1, tab2 = st.tabs(["📅 Historique", "🏆 Classement"])
     
     with tab1:
-        st.markdown("#### Votre activité récente")
-        if not df_rendement.empty:
-            df_mes_pesees = df_rendement[df_rendement['operatrice_id'] == st.session_state.username]
-            if not df_mes_pesees.empty:
-                st.dataframe(
-                    df_mes_pesees.sort_values('date', ascending=False).head(20),
-                    column_config={
-                        "date": "Date",
-                        "ligne": "Ligne",
-                        "poids_kg": st.column_config.NumberColumn("Poids (kg)", format="%.1f kg"),
-                        "numero_pesee": "N° Pesée",
-                        "rendement": st.column_config.NumberColumn("Rendement (kg/h)", format="%.1f"),
-                        "niveau_rendement": "Niveau"
-                    },
-                    hide_index=True,
-                    use_container_width=True
-                )
-            else:
-                st.info("Aucune pesée enregistrée")
-        
-        st.markdown("#### Vos signalements")
-        if not df_pannes.empty or not df_erreurs.empty:
-            df_mes_pannes = df_pannes[df_pannes['operatrice_id'] == st.session_state.username]
-            df_mes_erreurs = df_erreurs[df_erreurs['operatrice_id'] == st.session_state.username]
-            
-            if not df_mes_pannes.empty or not df_mes_erreurs.empty:
-                df_signals = pd.concat([
-                    df_mes_pannes.assign(type="Panne"),
-                    df_mes_erreurs.assign(type="Erreur")
-                ])
-                
-                st.dataframe(
-                    df_signals.sort_values('date_heure', ascending=False).head(10),
-                    column_config={
-                        "date_heure": "Date/Heure",
-                        "type_erreur": "Type",
-                        "ligne": "Ligne",
-                        "description": "Description",
-                        "gravite": "Gravité"
-                    },
-                    hide_index=True,
-                    use_container_width=True
-                )
-            else:
-                st.info("Aucun signalement enregistré")
+        onglet_historique_operatrice(periode)
     
     with tab2:
-      st.markdown("#### 🏆 Top 10 des opératrices (affichage visuel simple)")
-
-      if not df_rendement.empty and 'operatrice_id' in df_rendement.columns:
-        import plotly.graph_objects as go
-
-        # Calcul du rendement moyen par opératrice
-        perf_operatrices = df_rendement.groupby('operatrice_id')['rendement'].mean().reset_index()
-        perf_operatrices = perf_operatrices.sort_values(by='rendement', ascending=False).reset_index(drop=True)
-        top10 = perf_operatrices.head(10)
-
-        # Couleurs personnalisées pour chaque opératrice
-        couleurs = [
-            "#FFD700", "#C0C0C0", "#CD7F32", "#FF69B4", "#FF8C00",
-            "#00CED1", "#ADFF2F", "#9370DB", "#00FA9A", "#4682B4"
-        ]
-
-        # Création du graphique
-        fig = go.Figure(go.Bar(
-            x=top10['operatrice_id'],
-            y=top10['rendement'],
-            marker=dict(color=couleurs[:len(top10)]),
-            text=top10['rendement'].round(1).astype(str) + " kg/h",
-            textposition='outside',
-            width=0.85
-        ))
-
-        fig.update_layout(
-            height=500,
-            plot_bgcolor='white',
-            margin=dict(l=20, r=20, t=40, b=60),
-            showlegend=False,
-            xaxis=dict(
-                tickfont=dict(size=16, color='black'),
-                title='',
-                showline=False,
-                showticklabels=True,
-                showgrid=False,
-                zeroline=False
-            ),
-            yaxis=dict(
-                visible=False  # ❌ Masquer complètement l'axe des ordonnées
-            ),
-        )
-
-        st.plotly_chart(fig, use_container_width=True)
-      else:
-        st.warning("⚠️ Aucune donnée de rendement disponible pour le classement.")
+        onglet_classement(periode)
 
     st.stop()
 
@@ -763,105 +2570,52 @@ if st.session_state.role == "operateur":
 st.markdown("### 📊 Tableau de bord des performances")
 
 # Création d'une grille responsive
-with st.container():
-    # Première ligne - Rendements et productivité
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        rendement_l1 = kpis.get("rendement_ligne1", 0)
-        color = COLORS["success"] if rendement_l1 >= st.session_state.seuils["rendement"]["haut"] else COLORS["warning"] if rendement_l1 >= st.session_state.seuils["rendement"]["moyen"] else COLORS["danger"]
-        st.markdown(f"""
-        <div style="background: white; border-radius: 10px; padding: 15px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); border-left: 4px solid {color}">
-            <div style="font-size: 14px; color: #555; margin-bottom: 5px;">Rendement Ligne 1</div>
-            <div style="font-size: 24px; font-weight: bold; color: {color}">{rendement_l1:.1f} kg/h</div>
-            <div style="font-size: 12px; color: #777;">Cible: {st.session_state.seuils['rendement']['haut']} kg/h</div>
-            <progress value="{rendement_l1}" max="6" style="width: 100%; height: 6px;"></progress>
-        </div>
-        """, unsafe_allow_html=True)
+@st.fragment(run_every=intervalle_direct)
+def section_kpis(periode):
+    """Cartes KPI, rafraîchies seules en mode direct"""
+    kpis, _ = kpis_courants(periode)
+    seuils = st.session_state.seuils
+    # Première ligne - Rendement de chaque ligne de production et productivité
+    lignes = kpis.lignes()
+    colonnes = st.columns(len(lignes) + 2)
+    for col, ligne in zip(colonnes, lignes):
+        with col:
+            rendement_ligne = kpis.rendement_par_ligne.get(ligne, 0)
+            color = COLORS["success"] if rendement_ligne >= seuils["rendement"]["haut"] else COLORS["warning"] if rendement_ligne >= seuils["rendement"]["moyen"] else COLORS["danger"]
+            carte_kpi(f"Rendement Ligne {ligne}", f"{rendement_ligne:.1f} kg/h",
+                      f"Cible: {seuils['rendement']['haut']} kg/h", color, progression=(rendement_ligne, 6))
     
-    with col2:
-        rendement_l2 = kpis.get("rendement_ligne2", 0)
-        color = COLORS["success"] if rendement_l2 >= st.session_state.seuils["rendement"]["haut"] else COLORS["warning"] if rendement_l2 >= st.session_state.seuils["rendement"]["moyen"] else COLORS["danger"]
-        st.markdown(f"""
-        <div style="background: white; border-radius: 10px; padding: 15px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); border-left: 4px solid {color}">
-            <div style="font-size: 14px; color: #555; margin-bottom: 5px;">Rendement Ligne 2</div>
-            <div style="font-size: 24px; font-weight: bold; color: {color}">{rendement_l2:.1f} kg/h</div>
-            <div style="font-size: 12px; color: #777;">Cible: {st.session_state.seuils['rendement']['haut']} kg/h</div>
-            <progress value="{rendement_l2}" max="6" style="width: 100%; height: 6px;"></progress>
-        </div>
-        """, unsafe_allow_html=True)
+    with colonnes[-2]:
+        color = COLORS["success"] if kpis.non_productivite < seuils["non_productivite"] else COLORS["danger"]
+        carte_kpi("Non-productivité", f"{kpis.non_productivite:.1f}%",
+                  f"Seuil: {seuils['non_productivite']}%", color, progression=(kpis.non_productivite, 100))
     
-    with col3:
-        non_prod = kpis.get("non_productivite", 0)
-        color = COLORS["success"] if non_prod < st.session_state.seuils["non_productivite"] else COLORS["danger"]
-        st.markdown(f"""
-        <div style="background: white; border-radius: 10px; padding: 15px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); border-left: 4px solid {color}">
-            <div style="font-size: 14px; color: #555; margin-bottom: 5px;">Non-productivité</div>
-            <div style="font-size: 24px; font-weight: bold; color: {color}">{non_prod:.1f}%</div>
-            <div style="font-size: 12px; color: #777;">Seuil: {st.session_state.seuils['non_productivite']}%</div>
-            <progress value="{non_prod}" max="100" style="width: 100%; height: 6px;"></progress>
-        </div>
-        """, unsafe_allow_html=True)
+    with colonnes[-1]:
+        color = COLORS["success"] if kpis.sous_performance < seuils["sous_performance"] else COLORS["danger"]
+        carte_kpi("Sous-performance", f"{kpis.sous_performance:.1f}%",
+                  f"Seuil: {seuils['sous_performance']}%", color, progression=(kpis.sous_performance, 100))
     
-    with col4:
-        sous_perf = kpis.get("sous_performance", 0)
-        color = COLORS["success"] if sous_perf < st.session_state.seuils["sous_performance"] else COLORS["danger"]
-        st.markdown(f"""
-        <div style="background: white; border-radius: 10px; padding: 15px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); border-left: 4px solid {color}">
-            <div style="font-size: 14px; color: #555; margin-bottom: 5px;">Sous-performance</div>
-            <div style="font-size: 24px; font-weight: bold; color: {color}">{sous_perf:.1f}%</div>
-            <div style="font-size: 12px; color: #777;">Seuil: {st.session_state.seuils['sous_performance']}%</div>
-            <progress value="{sous_perf}" max="100" style="width: 100%; height: 6px;"></progress>
-        </div>
-        """, unsafe_allow_html=True)
-
     # Deuxième ligne - Autres indicateurs
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        variabilite = kpis.get("variabilite", 0)
-        color = COLORS["success"] if variabilite < st.session_state.seuils["variabilite"] else COLORS["danger"]
-        st.markdown(f"""
-        <div style="background: white; border-radius: 10px; padding: 15px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); border-left: 4px solid {color}">
-            <div style="font-size: 14px; color: #555; margin-bottom: 5px;">Variabilité</div>
-            <div style="font-size: 24px; font-weight: bold; color: {color}">{variabilite:.1f} kg/h</div>
-            <div style="font-size: 12px; color: #777;">Seuil: {st.session_state.seuils['variabilite']} kg/h</div>
-        </div>
-        """, unsafe_allow_html=True)
+        color = COLORS["success"] if kpis.variabilite < seuils["variabilite"] else COLORS["danger"]
+        carte_kpi("Variabilité", f"{kpis.variabilite:.1f} kg/h",
+                  f"Seuil: {seuils['variabilite']} kg/h", color)
     
     with col2:
-        pannes = kpis.get("nb_pannes", 0)
-        color = COLORS["success"] if pannes < st.session_state.seuils["pannes"] else COLORS["danger"]
-        st.markdown(f"""
-        <div style="background: white; border-radius: 10px; padding: 15px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); border-left: 4px solid {color}">
-            <div style="font-size: 14px; color: #555; margin-bottom: 5px;">Pannes</div>
-            <div style="font-size: 24px; font-weight: bold; color: {color}">{pannes}</div>
-            <div style="font-size: 12px; color: #777;">Seuil: {st.session_state.seuils['pannes']}</div>
-        </div>
-        """, unsafe_allow_html=True)
+        color = COLORS["success"] if kpis.nb_pannes < seuils["pannes"] else COLORS["danger"]
+        carte_kpi("Pannes", f"{kpis.nb_pannes}", f"Seuil: {seuils['pannes']}", color)
     
     with col3:
-        erreurs = kpis.get("ratio_erreurs", 0)
-        color = COLORS["success"] if erreurs < st.session_state.seuils["erreurs"] else COLORS["danger"]
-        st.markdown(f"""
-        <div style="background: white; border-radius: 10px; padding: 15px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); border-left: 4px solid {color}">
-            <div style="font-size: 14px; color: #555; margin-bottom: 5px;">Taux d'erreurs</div>
-            <div style="font-size: 24px; font-weight: bold; color: {color}">{erreurs:.1f}%</div>
-            <div style="font-size: 12px; color: #777;">Seuil: {st.session_state.seuils['erreurs']}%</div>
-            <progress value="{erreurs}" max="100" style="width: 100%; height: 6px;"></progress>
-        </div>
-        """, unsafe_allow_html=True)
+        color = COLORS["success"] if kpis.ratio_erreurs < seuils["erreurs"] else COLORS["danger"]
+        carte_kpi("Taux d'erreurs", f"{kpis.ratio_erreurs:.1f}%",
+                  f"Seuil: {seuils['erreurs']}%", color, progression=(kpis.ratio_erreurs, 100))
     
     with col4:
-        mtbf = kpis.get("mtbf", 0)
-        color = COLORS["primary"]
-        st.markdown(f"""
-        <div style="background: white; border-radius: 10px; padding: 15px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); border-left: 4px solid {color}">
-            <div style="font-size: 14px; color: #555; margin-bottom: 5px;">MTBF</div>
-            <div style="font-size: 24px; font-weight: bold; color: {color}">{mtbf:.1f} min</div>
-            <div style="font-size: 12px; color: #777;">Temps moyen entre pannes</div>
-        </div>
-        """, unsafe_allow_html=True)
+        carte_kpi("MTBF", f"{kpis.mtbf:.1f} min", "Temps moyen entre pannes", COLORS["primary"])
+
+section_kpis(periode)
 
 # Ajout d'une légende visuelle
 st.markdown("""
@@ -881,67 +2635,69 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 # Formulaire pour ajouter un nouveau produit
-with st.expander("➕ Ajouter un nouveau produit", expanded=False):
-        with st.form("nouveau_produit_form", clear_on_submit=True):
-            cols = st.columns(2)
-            with cols[0]:
-                reference = st.text_input("Référence*", max_chars=20)
-                lot = st.text_input("Lot*", max_chars=15)
-                ligne = st.selectbox("Ligne*", [1, 2])
-            with cols[1]:
-                operateur = st.text_input("Opérateur*", max_chars=50)
-                etat = st.selectbox("État*", ['En préparation', 'En cours', 'En contrôle', 'Terminé'])
-                date_expiration = st.date_input("Date expiration")
-            
-            notes = st.text_area("Notes")
-            
-            submitted = st.form_submit_button("💾 Enregistrer le produit")
-            
-            if submitted:
-                if not reference or not lot or not operateur:
-                    st.error("Les champs marqués d'un * sont obligatoires")
-                else:
-                    data = {
-                        "reference": reference,
-                        "lot": lot,
-                        "ligne": ligne,
-                        "operateur": operateur,
-                        "etat": etat,
-                        "date_expiration": date_expiration.isoformat() if date_expiration else None,
-                        "notes": notes if notes else None
-                    }
-                    
-                    try:
-                        response = requests.post(
-                            f"{SUPABASE_URL}/rest/v1/produits",
-                            headers=headers,
-                            json=data
-                        )
-                        if response.status_code == 201:
-                            st.success("Produit enregistré avec succès!")
-                            st.cache_data.clear()
-                            st.rerun()
-                        else:
-                            st.error(f"Erreur {response.status_code}: {response.text}")
-                    except Exception as e:
-                        st.error(f"Erreur lors de l'enregistrement: {str(e)}")
+@st.fragment
+def formulaire_produit():
+    """Enregistrement d'un nouveau produit"""
+    with st.form("nouveau_produit_form", clear_on_submit=True):
+        cols = st.columns(2)
+        with cols[0]:
+            reference = st.text_input("Référence*", max_chars=20)
+            lot = st.text_input("Lot*", max_chars=15)
+            ligne = st.selectbox("Ligne*", [1, 2])
+        with cols[1]:
+            operateur = st.text_input("Opérateur*", max_chars=50)
+            etat = st.selectbox("État*", ['En préparation', 'En cours', 'En contrôle', 'Terminé'])
+            date_expiration = st.date_input("Date expiration")
+        
+        notes = st.text_area("Notes")
+        
+        submitted = st.form_submit_button("💾 Enregistrer le produit")
+        
+        if submitted:
+            if not reference or not lot or not operateur:
+                st.error("Les champs marqués d'un * sont obligatoires")
             else:
-                  st.info("Aucun produit enregistré dans la base de données")
+                data = {
+                    "reference": reference,
+                    "lot": lot,
+                    "ligne": ligne,
+                    "operateur": operateur,
+                    "etat": etat,
+                    "date_expiration": date_expiration.isoformat() if date_expiration else None,
+                    "notes": notes if notes else None
+                }
+                
+                try:
+                    response = supabase_post("produits", data)
+                    if response.status_code == 201:
+                        st.success("Produit enregistré avec succès!")
+                        st.rerun()
+                    else:
+                        st.error(f"Erreur {response.status_code}: {response.text}")
+                except Exception as e:
+                    st.error(f"Erreur lors de l'enregistrement: {str(e)}")
+        else:
+              st.info("Aucun produit enregistré dans la base de données")
 
+with st.expander("➕ Ajouter un nouveau produit", expanded=False):
+    formulaire_produit()
 
 # Section visualisations
 st.markdown("### 📈 Visualisations")
 
-tab1, tab2, tab3, tab4 = st.tabs(["Rendements", "Performance", "Pannes", "Erreurs"])
-
-with tab1:
+# Un fragment par onglet : graphiques reconstruits seulement quand leurs données changent
+@st.fragment
+def onglet_rendements(periode):
+    """Évolution et distribution des rendements"""
+    df_rendement = donnees_courantes(periode).get(TABLE_RENDEMENT, pd.DataFrame())
+    rollups = charger_rollups(periode)
+    
     col1, col2 = st.columns(2)
     
     with col1:
         st.markdown("#### Évolution temporelle")
         if not df_rendement.empty and 'date' in df_rendement.columns:
-            df_rendement['jour'] = df_rendement['date'].dt.date
-            df_rend_jour = df_rendement.groupby(['jour', 'ligne'])['rendement'].mean().reset_index()
+            df_rend_jour = perf_par_groupe(rollups[TABLE_RENDEMENT], ['jour', 'ligne'])
             
             fig = px.line(
                 df_rend_jour,
@@ -967,14 +2723,17 @@ with tab1:
             )
             st.plotly_chart(fig, use_container_width=True)
 
-with tab2:
+@st.fragment
+def onglet_performance(periode):
+    """Performance par opératrice"""
+    df_rendement = donnees_courantes(periode).get(TABLE_RENDEMENT, pd.DataFrame())
+    rollups = charger_rollups(periode)
+    
     st.markdown("#### Performance par opératrice")
     if not df_rendement.empty and 'operatrice_id' in df_rendement.columns:
-        perf_operatrices = df_rendement.groupby('operatrice_id').agg(
-            rendement_moyen=('rendement', 'mean'),
-            total_kg=('poids_kg', 'sum'),
-            nb_pesees=('numero_pesee', 'count')
-        ).reset_index()
+        perf_operatrices = perf_par_groupe(rollups[TABLE_RENDEMENT], 'operatrice_id').rename(
+            columns={'rendement': 'rendement_moyen', 'kg': 'total_kg'}
+        )
         
         fig = px.scatter(
             perf_operatrices,
@@ -992,13 +2751,18 @@ with tab2:
         )
         st.plotly_chart(fig, use_container_width=True)
 
-with tab3:
+@st.fragment
+def onglet_pannes(periode):
+    """Répartition des pannes par ligne et par heure"""
+    df_pannes = donnees_courantes(periode).get(TABLE_PANNES, pd.DataFrame())
+    rollups = charger_rollups(periode)
+    
     if not df_pannes.empty:
         col1, col2 = st.columns(2)
         
         with col1:
             st.markdown("#### Pannes par ligne")
-            pannes_ligne = df_pannes.groupby('ligne').size().reset_index(name='count')
+            pannes_ligne = compter_signalements(rollups[TABLE_PANNES], 'ligne')
             fig = px.pie(
                 pannes_ligne,
                 values='count',
@@ -1010,8 +2774,7 @@ with tab3:
         with col2:
             st.markdown("#### Chronologie des pannes")
             if 'date_heure' in df_pannes.columns:
-                df_pannes['heure'] = df_pannes['date_heure'].dt.hour
-                pannes_heure = df_pannes.groupby('heure').size().reset_index(name='count')
+                pannes_heure = compter_signalements(rollups[TABLE_PANNES], 'heure')
                 fig = px.bar(
                     pannes_heure,
                     x='heure',
@@ -1020,13 +2783,18 @@ with tab3:
                 )
                 st.plotly_chart(fig, use_container_width=True)
 
-with tab4:
+@st.fragment
+def onglet_erreurs(periode):
+    """Répartition des erreurs par type et gravité"""
+    df_erreurs = donnees_courantes(periode).get(TABLE_ERREURS, pd.DataFrame())
+    rollups = charger_rollups(periode)
+    
     if not df_erreurs.empty:
         col1, col2 = st.columns(2)
         
         with col1:
             st.markdown("#### Types d'erreurs")
-            erreurs_type = df_erreurs.groupby('type_erreur').size().reset_index(name='count')
+            erreurs_type = compter_signalements(rollups[TABLE_ERREURS], 'type_erreur')
             fig = px.bar(
                 erreurs_type,
                 x='type_erreur',
@@ -1038,7 +2806,7 @@ with tab4:
         with col2:
             st.markdown("#### Gravité des erreurs")
             if 'gravite' in df_erreurs.columns:
-                erreurs_gravite = df_erreurs.groupby('gravite').size().reset_index(name='count')
+                erreurs_gravite = compter_signalements(rollups[TABLE_ERREURS], 'gravite')
                 fig = px.pie(
                     erreurs_gravite,
                     values='count',
@@ -1047,142 +2815,254 @@ with tab4:
                 )
                 st.plotly_chart(fig, use_container_width=True)
 
+tab1, tab2, tab3, tab4 = st.tabs(["Rendements", "Performance", "Pannes", "Erreurs"])
+
+with tab1:
+    onglet_rendements(periode)
+
+with tab2:
+    onglet_performance(periode)
+
+with tab3:
+    onglet_pannes(periode)
+
+with tab4:
+    onglet_erreurs(periode)
+
+# Section export (données filtrées et KPIs)
+@st.fragment
+def section_export(periode):
+    """Export Excel / CSV de la vue courante, généré à la demande"""
+    data = donnees_courantes(periode)
+    df_rendement = data.get(TABLE_RENDEMENT, pd.DataFrame())
+    df_pannes = data.get(TABLE_PANNES, pd.DataFrame())
+    df_erreurs = data.get(TABLE_ERREURS, pd.DataFrame())
+    kpis, _ = kpis_courants(periode)
+    
+    tables_export = {"Rendements": avec_niveau(df_rendement, st.session_state.seuils),
+                     "Pannes": df_pannes, "Erreurs": df_erreurs}
+    format_export = st.radio("Format", ["Excel (KPIs + tables)", "CSV"], horizontal=True)
+    if format_export == "CSV":
+        table_csv = st.selectbox("Table", list(tables_export))
+    
+    # Fichier généré à la demande uniquement, pas à chaque rerun
+    if st.button("Préparer l'export"):
+        ancien = st.session_state.get("export_fichier")
+        if ancien and os.path.exists(ancien):
+            os.remove(ancien)
+        with st.spinner("Génération du fichier..."):
+            if format_export == "CSV":
+                st.session_state.export_fichier = exporter_csv(tables_export[table_csv])
+                st.session_state.export_nom = f"vacpa_{table_csv.lower()}_{datetime.now():%Y%m%d_%H%M}.csv"
+            else:
+                st.session_state.export_fichier = exporter_excel(tables_export, kpis)
+                st.session_state.export_nom = f"vacpa_export_{datetime.now():%Y%m%d_%H%M}.xlsx"
+    
+    fichier_export = st.session_state.get("export_fichier")
+    if fichier_export and os.path.exists(fichier_export):
+        with open(fichier_export, "rb") as f:
+            st.download_button(
+                "⬇️ Télécharger",
+                data=f,
+                file_name=st.session_state.export_nom,
+                mime="text/csv" if fichier_export.endswith(".csv") else
+                     "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+
+with st.expander("📦 Exporter les données"):
+    section_export(periode)
+
 # Section gestion
 st.markdown("### 🛠️ Gestion")
 
-tab1, tab2 = st.tabs(["Pannes/Erreurs", "Paramètres"])
+@st.fragment
+def formulaire_signalement_admin():
+    """Signalement de problème (admin)"""
+    with st.form("probleme_form"):
+        cols = st.columns(2)
+        with cols[0]:
+            type_probleme = st.selectbox("Type de problème", ["Panne", "Erreur", "Problème qualité", "Autre"])
+            ligne = st.selectbox("Ligne concernée", [1, 2])
+        with cols[1]:
+            gravite = st.select_slider("Gravité", options=GRAVITES)
+        
+        description = st.text_area("Description détaillée")
+        
+        submitted = st.form_submit_button("⚠️ Envoyer le signalement")
+        
+        if submitted:
+            table = TABLE_PANNES if type_probleme == "Panne" else TABLE_ERREURS
+            data = {
+                "ligne": ligne,
+                "type_erreur": type_probleme,
+                "gravite": gravite,
+                "description": description,
+                "operatrice_id": st.session_state.username,
+                "date_heure": datetime.now().isoformat(),  # Ajout de la date/heure
+                "created_at": datetime.now().isoformat() + "Z"
+            }
+            
+            try:
+                mettre_en_attente(table, data, st.session_state.username)
+                st.success("Signalement enregistré!")
+                st.rerun()
+            except sqlite3.Error as e:
+                st.error(f"Erreur: {str(e)}")
+
+@st.fragment
+def onglet_import():
+    """Import de pesées depuis un fichier CSV / Excel"""
+    if st.session_state.role == "admin":
+        st.markdown("#### 📤 Import de pesées (CSV / Excel)")
+        st.caption(f"Colonnes requises : {', '.join(IMPORT_COLONNES_REQUISES)} "
+                   "(optionnelles : heure_travail, commentaire_pesee, type_produit). Dates au format AAAA-MM-JJ.")
+        fichier = st.file_uploader("Fichier de pesées", type=["csv", "xlsx"], key="import_pesees")
+        
+        if fichier is not None:
+            try:
+                valides, rejetees = valider_pesees(lire_fichier_pesees(fichier))
+            except Exception as e:
+                st.error(f"Fichier invalide: {str(e)}")
+            else:
+                st.write(f"{len(valides)} pesée(s) prête(s) à importer, {len(rejetees)} ligne(s) écartée(s)")
+                if not rejetees.empty:
+                    with st.expander("Lignes écartées"):
+                        st.dataframe(rejetees, use_container_width=True)
+                
+                if not valides.empty and st.button("📥 Importer les pesées", type="primary"):
+                    progression = st.progress(0.0)
+                    try:
+                        nb_inserees, nb_doublons, erreurs = importer_pesees(valides, progression)
+                        st.success(f"{nb_inserees} pesée(s) importée(s), {nb_doublons} doublon(s) ignoré(s)")
+                        for erreur in erreurs:
+                            st.error(erreur)
+                    except Exception as e:
+                        st.error(f"Erreur de connexion: {str(e)}")
+    else:
+        st.info("L'import de pesées est réservé aux administrateurs.")
+
+@st.fragment
+def panneau_seuils():
+    """Réglage des seuils des KPIs et alertes, appliqués à toutes les sessions"""
+    contenu = seuils_courants()
+    if contenu.get("modifie_par"):
+        st.caption(f"Version {contenu['version']} — modifiés le {contenu['modifie_le']} par {contenu['modifie_par']}")
+    else:
+        st.caption("Seuils par défaut")
+    
+    seuils = json.loads(json.dumps(st.session_state.seuils))
+    # Rendement (float)
+    seuils["rendement"]["haut"] = st.number_input(
+        "Seuil haut rendement (kg/h)", 
+        value=float(seuils["rendement"]["haut"]), 
+        step=0.1,
+        format="%.1f"
+    )
+    seuils["rendement"]["moyen"] = st.number_input(
+        "Seuil moyen rendement (kg/h)", 
+        value=float(seuils["rendement"]["moyen"]), 
+        step=0.1,
+        format="%.1f"
+    )
+    seuils["rendement"]["critique"] = st.number_input(
+        "Seuil critique rendement (kg/h)",
+        value=float(seuils["rendement"]["critique"]),
+        step=0.1,
+        format="%.1f"
+    )
+    
+    # Non-productivité (int)
+    seuils["non_productivite"] = int(st.number_input(
+        "Seuil non-productivité (%)",
+        value=int(seuils["non_productivite"]),
+        step=1
+    ))
+    
+    # Sous-performance (int)
+    seuils["sous_performance"] = int(st.number_input(
+        "Seuil sous-performance (%)",
+        value=int(seuils["sous_performance"]),
+        step=1
+    ))
+    
+    # Variabilité (float)
+    seuils["variabilite"] = st.number_input(
+        "Seuil variabilité (kg/h)",
+        value=float(seuils["variabilite"]),
+        step=0.1,
+        format="%.1f"
+    )
+    
+    # Pannes (int)
+    seuils["pannes"] = int(st.number_input(
+        "Seuil nombre de pannes",
+        value=int(seuils["pannes"]),
+        step=1
+    ))
+    
+    # Erreurs (int)
+    seuils["erreurs"] = int(st.number_input(
+        "Seuil taux d'erreurs (%)",
+        value=int(seuils["erreurs"]),
+        step=1
+    ))
+    
+    if st.button("Appliquer les nouveaux seuils"):
+        rendement = seuils["rendement"]
+        if not 0 < rendement["critique"] < rendement["moyen"] < rendement["haut"]:
+            st.error("Les seuils de rendement doivent vérifier 0 < critique < moyen < haut")
+        else:
+            # Aucun rechargement : KPIs et niveaux recalculés depuis la copie en mémoire
+            enregistrer_seuils(seuils, st.session_state.username)
+            synchroniser_seuils_session()
+            st.rerun()  # Recharge la page
+
+@st.fragment
+def panneau_diagnostic():
+    """Migration manquante, mémoire des tables partagées, valeurs hors référentiel et sondes de synchronisation"""
+    sans_migration = get_tables_sans_migration()
+    if sans_migration:
+        st.warning(f"Migration migrations/001_ecritures_idempotentes.sql non appliquée ({', '.join(sorted(sans_migration))}) : "
+                   "insertions simples, la base n'écarte plus les doublons ni les renvois de la file d'attente.")
+        if st.button("Vérifier à nouveau la migration"):
+            # La prochaine écriture retente l'insertion idempotente
+            sans_migration.clear()
+            st.rerun()
+    
+    hors_referentiel = valeurs_hors_referentiel()
+    if not hors_referentiel.empty:
+        st.warning(f"{int(hors_referentiel['Lignes'].sum())} ligne(s) avec une gravité hors référentiel "
+                   f"({', '.join(GRAVITES)}) : conservées, classées après « {GRAVITES[-1]} »")
+        st.dataframe(hors_referentiel, use_container_width=True, hide_index=True)
+    
+    with st.expander("🧮 Mémoire des données"):
+        st.caption("Tables partagées par toutes les sessions : types compacts (catégories, int8, float32) "
+                   "comparés aux types par défaut (object, int64, float64).")
+        if st.button("Mesurer la mémoire"):
+            st.dataframe(rapport_memoire(), use_container_width=True, hide_index=True)
+    
+    with st.expander("📡 Synchronisation"):
+        st.caption("Sondes de changement par table : les tables inchangées ne sont pas retéléchargées.")
+        sondes = get_table_store()["sondes"]
+        st.dataframe(pd.DataFrame([
+            {"Table": table, "Inchangée (ignorée)": compteurs["inchangee"], "Modifiée (téléchargée)": compteurs["modifiee"]}
+            for table, compteurs in sondes.items()
+        ]), use_container_width=True, hide_index=True)
+
+tab1, tab_import, tab2 = st.tabs(["Pannes/Erreurs", "Import pesées", "Paramètres"])
 
 with tab1:
     # Signalement de problème (admin)
     with st.expander("⚠️ Signaler un problème technique", expanded=False):
-        with st.form("probleme_form"):
-            cols = st.columns(2)
-            with cols[0]:
-                type_probleme = st.selectbox("Type de problème", ["Panne", "Erreur", "Problème qualité", "Autre"])
-                ligne = st.selectbox("Ligne concernée", [1, 2])
-            with cols[1]:
-                gravite = st.select_slider("Gravité", options=["Léger", "Modéré", "Grave", "Critique"])
-            
-            description = st.text_area("Description détaillée")
-            
-            submitted = st.form_submit_button("⚠️ Envoyer le signalement")
-            
-            if submitted:
-                table = TABLE_PANNES if type_probleme == "Panne" else TABLE_ERREURS
-                data = {
-                    "ligne": ligne,
-                    "type_erreur": type_probleme,
-                    "gravite": gravite,
-                    "description": description,
-                    "operatrice_id": st.session_state.username,
-                    "date_heure": datetime.now().isoformat(),  # Ajout de la date/heure
-                    "created_at": datetime.now().isoformat() + "Z"
-                }
-                
-                try:
-                    response = requests.post(
-                        f"{SUPABASE_URL}/rest/v1/{table}",
-                        headers=headers,
-                        json=data
-                    )
-                    if response.status_code == 201:
-                        st.success("Signalement enregistré!")
-                        st.cache_data.clear()
-                        st.rerun()
-                    else:
-                        st.error(f"Erreur {response.status_code}: {response.text}")
-                except Exception as e:
-                    st.error(f"Erreur: {str(e)}")
+        formulaire_signalement_admin()
+    
+    afficher_etat_file_attente(st.session_state.username)
+with tab_import:
+    onglet_import()
+
 with tab2:
     if st.session_state.role in ["admin", "manager"]:
         with st.expander("⚙️ Paramètres des seuils", expanded=True):
-            # Rendement (float)
-            st.session_state.seuils["rendement"]["haut"] = st.number_input(
-                "Seuil haut rendement (kg/h)", 
-                value=float(st.session_state.seuils["rendement"]["haut"]), 
-                step=0.1,
-                format="%.1f"
-            )
-            st.session_state.seuils["rendement"]["moyen"] = st.number_input(
-                "Seuil moyen rendement (kg/h)", 
-                value=float(st.session_state.seuils["rendement"]["moyen"]), 
-                step=0.1,
-                format="%.1f"
-            )
-            
-            # Non-productivité (int)
-            st.session_state.seuils["non_productivite"] = int(st.number_input(
-                "Seuil non-productivité (%)",
-                value=int(st.session_state.seuils["non_productivite"]),
-                step=1
-            ))
-            
-            # Sous-performance (int)
-            st.session_state.seuils["sous_performance"] = int(st.number_input(
-                "Seuil sous-performance (%)",
-                value=int(st.session_state.seuils["sous_performance"]),
-                step=1
-            ))
-            
-            # Variabilité (float)
-            st.session_state.seuils["variabilite"] = st.number_input(
-                "Seuil variabilité (kg/h)",
-                value=float(st.session_state.seuils["variabilite"]),
-                step=0.1,
-                format="%.1f"
-            )
-            
-            # Pannes (int)
-            st.session_state.seuils["pannes"] = int(st.number_input(
-                "Seuil nombre de pannes",
-                value=int(st.session_state.seuils["pannes"]),
-                step=1
-            ))
-            
-            # Erreurs (int)
-            st.session_state.seuils["erreurs"] = int(st.number_input(
-                "Seuil taux d'erreurs (%)",
-                value=int(st.session_state.seuils["erreurs"]),
-                step=1
-            ))
-            
-            if st.button("Appliquer les nouveaux seuils"):
-                st.cache_data.clear()  # Force le recalcul des KPI
-                st.rerun()  # Recharge la page
-# --------------------------
-# 📅 Filtres (uniquement pour admin/manager)
-# --------------------------
-if st.session_state.role in ["admin", "manager"]:
-    with st.expander("🔍 Filtres"):
-        # Vérifie si toutes les colonnes nécessaires existent
-        dates_rendement = df_rendement["created_at"] if "created_at" in df_rendement.columns else None
-        dates_pannes = df_pannes["created_at"] if "created_at" in df_pannes.columns else None
-        dates_erreurs = df_erreurs["created_at"] if "created_at" in df_erreurs.columns else None
-
-        # Choisir une date de référence pour initialiser les filtres
-        all_dates = pd.concat([d for d in [dates_rendement, dates_pannes, dates_erreurs] if d is not None])
-        if not all_dates.empty:
-            date_min = all_dates.min().date()
-            date_max = all_dates.max().date()
-        else:
-            date_min = date_max = datetime.today().date()
-
-        start_date, end_date = st.date_input("Plage de dates", [date_min, date_max])
-
-        # Appliquer les filtres à chaque table
-        if dates_rendement is not None:
-            df_rendement = df_rendement[
-                (df_rendement["created_at"].dt.date >= start_date) &
-                (df_rendement["created_at"].dt.date <= end_date)
-            ]
-
-        if "created_at" in df_pannes.columns:
-            df_pannes = df_pannes[
-                (df_pannes["created_at"].dt.date >= start_date) &
-                (df_pannes["created_at"].dt.date <= end_date)
-            ]
-        if "created_at" in df_erreurs.columns:
-            df_erreurs = df_erreurs[
-                (df_erreurs["created_at"].dt.date >= start_date) &
-                (df_erreurs["created_at"].dt.date <= end_date)
-            ]
+            panneau_seuils()
+        
+        panneau_diagnostic()
@@ -0,0 +1,52 @@
+-- Prérequis des écritures idempotentes de app.py (file d'attente des saisies, import de pesées).
+-- À exécuter dans l'éditeur SQL de Supabase, avant de déployer l'application.
+-- Le script peut être relancé : chaque étape vérifie si elle a déjà été appliquée.
+--
+-- Sans cette migration, l'application bascule en insertion simple : les écritures
+-- aboutissent, mais la base n'écarte plus les doublons (renvoi après coupure réseau,
+-- même numéro de pesée saisi sur deux postes). Le panneau Paramètres > diagnostic
+-- de l'administrateur le signale.
+
+BEGIN;
+
+-- Clé d'idempotence générée à la saisie (file d'attente locale)
+ALTER TABLE rendements ADD COLUMN IF NOT EXISTS cle_idempotence uuid UNIQUE;
+ALTER TABLE pannes ADD COLUMN IF NOT EXISTS cle_idempotence uuid UNIQUE;
+ALTER TABLE erreurs ADD COLUMN IF NOT EXISTS cle_idempotence uuid UNIQUE;
+
+-- Doublons déjà enregistrés par l'ancien contrôle (lecture puis insertion) : la contrainte
+-- ne pourrait pas être créée. Pour chaque (opératrice, jour, numéro) on garde la première
+-- pesée (plus petit id) ; les autres sont archivées dans rendements_doublons puis supprimées.
+CREATE TABLE IF NOT EXISTS rendements_doublons (LIKE rendements INCLUDING DEFAULTS);
+
+WITH doublons AS (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (
+            PARTITION BY operatrice_id, date, numero_pesee ORDER BY id
+        ) AS rang
+        FROM rendements
+        -- Des NULL ne violent pas une contrainte UNIQUE : ces lignes restent en place
+        WHERE operatrice_id IS NOT NULL AND date IS NOT NULL AND numero_pesee IS NOT NULL
+    ) classees
+    WHERE rang > 1
+), archivees AS (
+    INSERT INTO rendements_doublons
+    SELECT r.* FROM rendements r JOIN doublons d ON d.id = r.id
+    RETURNING id
+)
+DELETE FROM rendements WHERE id IN (SELECT id FROM archivees);
+
+-- Une pesée par (opératrice, jour, numéro) : cible du on_conflict des insertions groupées
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'rendements_pesee_unique'
+          AND conrelid = 'rendements'::regclass
+    ) THEN
+        ALTER TABLE rendements
+            ADD CONSTRAINT rendements_pesee_unique UNIQUE (operatrice_id, date, numero_pesee);
+    END IF;
+END $$;
+
+COMMIT;
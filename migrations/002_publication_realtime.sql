@@ -0,0 +1,22 @@
+-- Prérequis du mode direct de app.py (flux Supabase Realtime).
+-- À exécuter dans l'éditeur SQL de Supabase ; le script peut être relancé.
+--
+-- Supabase n'émet les insertions que pour les tables de la publication supabase_realtime.
+-- Sans cette migration, le canal est accepté mais aucun événement n'arrive : seule la
+-- synchronisation périodique alimente alors les tableaux de bord.
+
+DO $$
+DECLARE
+    nom_table text;
+BEGIN
+    FOREACH nom_table IN ARRAY ARRAY['rendements', 'pannes', 'erreurs'] LOOP
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_publication_tables
+            WHERE pubname = 'supabase_realtime'
+              AND schemaname = 'public'
+              AND tablename = nom_table
+        ) THEN
+            EXECUTE format('ALTER PUBLICATION supabase_realtime ADD TABLE public.%I', nom_table);
+        END IF;
+    END LOOP;
+END $$;